@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+These functions rerun a sample of torsions and concentrations with one or more solver backends and
+compare the fluxes with the scan pickles and Chimera attribute files that ship with the
+manuscript, reporting the largest error next to the time each backend took.
+
+    python audit.py --backends legacy exact batch --torsions 10
+
+The published numbers were calculated with the dense eigenvector path (the 'legacy' backend), so
+that backend should reproduce them; the others are judged against it, and the 'exact' backend (the
+refined direct solve) shows how far the published numbers are from the accurate ones.
+"""
+
+import re
+import time
+
+import numpy as np
+
+from bank import discover_names
+from batch import flux_observables, simulate_batch
+from scan import read_histograms
+from simulation import Simulation
+
+# The scan pickles, with the data source and catalytic rate they were calculated with.
+PICKLES = {'adk-concentration-scan.pickle': ('adk_md_data', 312),
+           'adk-low-catalytic-rate-10.pickle': ('adk_md_data', 10),
+           'hiv-concentration-scan-catalytic-rate-10.pickle': ('hiv_md_data', 10),
+           'hiv-concentration-scan-catalytic-rate-200.pickle': ('hiv_md_data', 200),
+           'hiv-high-catalytic-rate-100.pickle': ('hiv_md_data', 100),
+           'hiv-high-catalytic-rate-300.pickle': ('hiv_md_data', 300)}
+
+# The Chimera files of the largest |directional flux| per residue, with the data source, catalytic
+# rate, concentration (log10) and the offset between the torsion and the PDB residue numbering.
+CHIMERA = {'adk-directional-flux-chimera.dat': ('adk_md_data', 312, -3, 0),
+           'hiv-200-directional-flux-chimera.dat': ('hiv_md_data', 200, -3, 0),
+           'pka-directional-flux-chimera.dat': ('pka_md_data', 140, -3, 14)}
+
+QUANTITIES = ('Directional flux', 'Intersurface flux', 'Driven flux')
+
+
+def _simulation_backend(**settings):
+    def backend(data_source, names, concentrations, catalytic_rate):
+        rows = []
+        for name in names:
+            for concentration in concentrations:
+                this = Simulation(data_source=data_source)
+                this.name = name
+                this.cSubstrate = 10 ** concentration
+                this.catalytic_rate = catalytic_rate
+                for key, value in settings.items():
+                    setattr(this, key, value)
+                this.simulate()
+                record = this.observables()
+                rows.append((record['directional_flux'], record['intersurface_flux'],
+                             record['driven_flux']))
+        return np.array(rows).reshape(-1, len(QUANTITIES))
+    return backend
+
+
+def _batch_backend(data_source, names, concentrations, catalytic_rate):
+    unbound, bound = read_histograms(data_source, names)
+    n = len(concentrations)
+    model = Simulation(data_source=data_source).parameters()
+    model['catalytic_rate'] = catalytic_rate
+    model['cSubstrate'] = 10 ** np.tile(np.asarray(concentrations, dtype=float), len(names))
+    observables = flux_observables(simulate_batch(np.repeat(unbound, n, axis=0),
+                                                  np.repeat(bound, n, axis=0), model))
+    return np.column_stack([observables[quantity] for quantity in QUANTITIES])
+
+
+# Each backend takes a data source, torsion names, log10 concentrations and a catalytic rate, and
+# returns an (names x concentrations, 3) array of `QUANTITIES`, ordered by torsion then concentration.
+BACKENDS = {'legacy': _simulation_backend(),
+            'exact': _simulation_backend(profile='exact'),
+            'partial': _simulation_backend(eigensolver='partial'),
+            'fast': _simulation_backend(profile='fast'),
+            'screen': _simulation_backend(profile='screen'),
+            'generator': _simulation_backend(pipeline='generator'),
+            'batch': _batch_backend}
+
+
+def read_chimera(filename):
+    """
+    Read a Chimera attribute file written by `data_frame_to_chimera`.
+    :return: a dictionary from residue number to value; residues written as `nan` are left out
+    """
+    values = {}
+    with open(filename) as f:
+        for line in f:
+            if line.startswith('\t:'):
+                residue, value = line.split()
+                if value != 'nan':
+                    values[int(residue[1:])] = float(value)
+    return values
+
+
+def _errors(values, reference, atol):
+    difference = np.abs(values - reference)
+    return np.max(difference), np.max(difference / (np.abs(reference) + atol))
+
+
+def audit_pickle(filename, backends=('legacy', 'exact', 'batch'), names=None, concentrations=None,
+                 torsions=5, seed=None, atol=1e-4):
+    """
+    Rerun part of a scan pickle with each backend and compare every flux.
+    :param filename: one of `PICKLES`
+    :param backends: names of entries of `BACKENDS`
+    :param names: the torsions to rerun; by default, `torsions` picked at random
+    :param concentrations: the concentrations (log10) to rerun; by default -5, -3 and -1
+    :param torsions: the number of torsions to pick at random
+    :param seed: the seed of the random pick
+    :param atol: the relative error is |new - reference| / (|reference| + atol), so fluxes far
+    below the thresholds of interest do not dominate it
+    :return: a list of dictionaries, one per backend
+    """
+    import pandas as pd
+    data_source, catalytic_rate = PICKLES[filename]
+    reference = pd.read_pickle(filename)
+    if names is None:
+        files = np.unique(reference['File'])
+        names = list(np.random.RandomState(seed).choice(files, min(torsions, len(files)),
+                                                        replace=False))
+    if concentrations is None:
+        concentrations = [-5, -3, -1]
+    expected = []
+    for name in names:
+        for concentration in concentrations:
+            row = reference[(reference['File'] == name) &
+                            (np.round(reference['Concentration'], 1) == round(concentration, 1))]
+            expected.append(row[list(QUANTITIES)].values[0])
+    expected = np.array(expected)
+    report = []
+    for backend in backends:
+        start = time.time()
+        values = BACKENDS[backend](data_source, names, concentrations, catalytic_rate)
+        elapsed = time.time() - start
+        absolute, relative = _errors(values, expected, atol)
+        report.append({'Reference': filename, 'Backend': backend, 'Solves': len(values),
+                       'Max absolute error': absolute, 'Max relative error': relative,
+                       'Time (s)': elapsed, 'Time per solve (s)': elapsed / len(values)})
+    return report
+
+
+def audit_chimera(filename, backends=('legacy', 'exact', 'batch'), residues=5, seed=None,
+                  atol=1e-4):
+    """
+    Recalculate the largest |directional flux| of some residues of a Chimera file with each
+    backend. Residues are matched to torsions by the number at the end of the torsion name, as in
+    the scan pickles.
+    :param filename: one of `CHIMERA`
+    :param backends: names of entries of `BACKENDS`
+    :param residues: the number of residues to pick at random among those with values
+    :param seed: the seed of the random pick
+    :param atol: see `audit_pickle`
+    :return: a list of dictionaries, one per backend; empty if the file holds no values
+    """
+    data_source, catalytic_rate, concentration, offset = CHIMERA[filename]
+    reference = read_chimera(filename)
+    if not reference:
+        print('{} holds no values to compare with.'.format(filename))
+        return []
+    names = discover_names(data_source)
+    residue_of = {name: int(re.match('.*?([0-9]+)$', name).group(1)) + offset for name in names}
+    candidates = sorted(set(residue_of.values()) & set(reference))
+    chosen = np.random.RandomState(seed).choice(candidates, min(residues, len(candidates)),
+                                                replace=False)
+    names = [name for name in names if residue_of[name] in chosen]
+    expected = np.array([reference[residue] for residue in chosen])
+    report = []
+    for backend in backends:
+        start = time.time()
+        values = BACKENDS[backend](data_source, names, [concentration], catalytic_rate)
+        elapsed = time.time() - start
+        directional = np.abs(values[:, 0])
+        calculated = np.array([np.max(directional[[residue_of[name] == residue for name in names]])
+                               for residue in chosen])
+        absolute, relative = _errors(calculated, expected, atol)
+        report.append({'Reference': filename, 'Backend': backend, 'Solves': len(values),
+                       'Max absolute error': absolute, 'Max relative error': relative,
+                       'Time (s)': elapsed, 'Time per solve (s)': elapsed / len(values)})
+    return report
+
+
+def audit(pickles=None, chimera=None, backends=('legacy', 'exact', 'batch'), torsions=5, seed=None,
+          atol=1e-4):
+    """
+    Audit every backend against the shipped pickles and Chimera files.
+    :return: a dataframe with one row per reference file and backend
+    """
+    import pandas as pd
+    report = []
+    for filename in (PICKLES if pickles is None else pickles):
+        report += audit_pickle(filename, backends, torsions=torsions, seed=seed, atol=atol)
+    for filename in (CHIMERA if chimera is None else chimera):
+        report += audit_chimera(filename, backends, residues=torsions, seed=seed, atol=atol)
+    return pd.DataFrame(report)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compare solver backends with the shipped results.')
+    parser.add_argument('--backends', nargs='+', default=['legacy', 'exact', 'batch'],
+                        choices=sorted(BACKENDS))
+    parser.add_argument('--pickles', nargs='*', choices=sorted(PICKLES))
+    parser.add_argument('--chimera', nargs='*', choices=sorted(CHIMERA))
+    parser.add_argument('--torsions', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    print(audit(args.pickles, args.chimera, args.backends, args.torsions, args.seed).to_string())
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+This has a single class: `HistogramBank`
+A histogram bank reads every apo and bound histogram of a data source once and keeps them in a
+single block of `multiprocessing.shared_memory`. Worker processes attach to the block by name and
+read rows as views, without copying and without touching `md-data`.
+
+    with HistogramBank.load('adk_md_data') as bank:
+        this = Simulation(data_source='adk_md_data')
+        this.bank = bank
+        this.name = 'chi2THR175'
+        this.simulate()
+
+A bank pickles as its name only, so it can be passed to pool workers as an argument.
+"""
+
+import glob
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from simulation import Simulation
+
+
+def discover_names(data_source):
+    """
+    Return the sorted names of every torsion that has an unbound histogram for the data source.
+    """
+    this = Simulation(data_source=data_source)
+    this.name = '*'
+    files = this.population_files()
+    if files is None:
+        return []
+    prefix, suffix = files[0].split('*')
+    return sorted(path[len(prefix):len(path) - len(suffix)]
+                  for path in glob.glob(files[0]))
+
+
+def read_populations(data_source, names):
+    """
+    Read the unbound and bound population histograms of several torsions from disk.
+    :param data_source: one of the recognized protein systems in the class
+    :param names: a list of torsion filenames
+    :return: two lists of arrays, in the order of `names`
+    :raises IOError: if the histograms of a torsion cannot be read
+    """
+    this = Simulation(data_source=data_source)
+    unbound, bound = [], []
+    for name in names:
+        this.name = name
+        # `read_populations` only prints when it cannot read a file, which would leave the
+        # histograms of the previous torsion in place.
+        this.unbound_population = this.bound_population = None
+        this.read_populations()
+        if this.unbound_population is None or this.bound_population is None:
+            raise IOError('Cannot read the histograms of {} from {}.'.format(name, data_source))
+        unbound.append(this.unbound_population)
+        bound.append(this.bound_population)
+    return unbound, bound
+
+
+# Banks this process has attached to, so a worker attaches once rather than once per task.
+_attached = {}
+
+
+def _attach(name):
+    try:
+        # Python 3.13 and later: do not let this process unlink the block when it exits.
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _read_only(view):
+    view.setflags(write=False)
+    return view
+
+
+class HistogramBank(object):
+    """
+    The unbound and bound histograms of many torsions, as a (2, N, bins) float64 array in shared
+    memory.
+    """
+
+    def __init__(self, memory, data_source, names, bins, owner=False):
+        self.memory = memory
+        self.data_source = data_source
+        self.names = list(names)
+        self.bins = bins
+        self.owner = owner
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.array = np.ndarray((2, len(self.names), bins), dtype=np.float64, buffer=memory.buf)
+
+    @classmethod
+    def load(cls, data_source, names=None):
+        """
+        Read the histograms from disk into a new block of shared memory. The process that loads
+        the bank owns it and should `unlink` it (or use it as a context manager) when done.
+        :param data_source: one of the recognized protein systems in the class
+        :param names: the torsions to load; every torsion of the data source by default
+        :raises IOError: if the histograms of a torsion cannot be read
+        """
+        if names is None:
+            names = discover_names(data_source)
+        unbound, bound = read_populations(data_source, names)
+        stacked = np.array([unbound, bound], dtype=np.float64)
+        memory = shared_memory.SharedMemory(create=True, size=max(stacked.nbytes, 1))
+        bank = cls(memory, data_source, names, stacked.shape[2], owner=True)
+        bank.array[...] = stacked
+        return bank
+
+    @property
+    def descriptor(self):
+        """
+        Everything another process needs to attach to the bank.
+        """
+        return (self.memory.name, self.data_source, self.names, self.bins)
+
+    @classmethod
+    def attach(cls, descriptor):
+        """
+        Attach to a bank that another process has loaded.
+        """
+        memory_name = descriptor[0]
+        if memory_name not in _attached:
+            _attached[memory_name] = cls(_attach(memory_name), *descriptor[1:])
+        return _attached[memory_name]
+
+    def __reduce__(self):
+        return (HistogramBank.attach, (self.descriptor,))
+
+    @property
+    def unbound(self):
+        return _read_only(self.array[0])
+
+    @property
+    def bound(self):
+        return _read_only(self.array[1])
+
+    def populations(self, name):
+        """
+        Return read-only views of the unbound and bound histograms of a torsion; every process
+        attached to the bank shares them, so they must not be changed in place.
+        """
+        i = self.index[name]
+        return _read_only(self.array[0, i]), _read_only(self.array[1, i])
+
+    def rows(self, names):
+        """
+        Return (N, bins) copies of the unbound and bound histograms of several torsions.
+        """
+        index = [self.index[name] for name in names]
+        return self.array[0, index], self.array[1, index]
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.names)
+
+    def close(self):
+        """
+        Detach from the shared memory. Views taken from the bank must not be used afterwards.
+        """
+        self.array = None
+        self.memory.close()
+
+    def unlink(self):
+        """
+        Close the bank and free the shared memory.
+        """
+        self.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.unlink()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+"""
+These functions calculate steady states and fluxes for many pairs of histograms at once.
+They follow the same steps as `Simulation.simulate()`, but every step works on an (N x bins) array
+so a stack of torsions, bootstrap replicas or parameter values costs a few array operations
+instead of N separate simulations.
+"""
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+from observables import LABELS, batch_observables
+
+
+# Solver profiles: the floating point type of the linear solve, the number of steps of iterative
+# refinement in float64, and the residual |p K| (per second, the units of the fluxes) above which a
+# solve is flagged for an exact rerun. A float32 solve is only used where it is safe, i.e., where
+# its rounding error on the largest rates stays below the tolerance; with stiff rate matrices
+# (large `D`) the solve falls back to float64. `Simulation` uses the same profiles, and by default
+# its 'legacy' profile, the dense eigenvector calculation of the published results.
+PROFILES = {'exact': {'dtype': np.float64, 'refine': 2, 'tolerance': 1e-4},
+            'fast': {'dtype': np.float64, 'refine': 1, 'tolerance': 1e-3},
+            'screen': {'dtype': np.float32, 'refine': 0, 'tolerance': 1e-1}}
+
+
+def _column(value, n):
+    """
+    Broadcast a scalar or a length-N array of parameter values to an (N, 1) column.
+    """
+    return np.broadcast_to(np.asarray(value, dtype=float).reshape(-1, 1), (n, 1))
+
+
+def histograms_to_log_populations(histograms, periodic=False):
+    """
+    The temperature-independent part of `histograms_to_energies`: smooth, floor and normalize the
+    histograms and return the logarithm of the populations.
+    :param histograms: an (N, bins) array of populations
+    :param periodic: smooth across the boundary between the last and the first bin, as the angle is
+    periodic; by default the edges are reflected, as in the published results
+    :return: an (N, bins) array of log-populations
+    """
+    histograms = np.atleast_2d(np.asarray(histograms, dtype=float))
+    smooth = gaussian_filter(histograms, sigma=(0, 1), mode='wrap' if periodic else 'reflect')
+    minimum = np.where(smooth != 0, smooth, np.inf).min(axis=1, keepdims=True)
+    smooth = np.where(smooth != 0, smooth, minimum)
+    smooth /= smooth.sum(axis=1, keepdims=True)
+    return np.log(smooth)
+
+
+def histograms_to_energies(histograms, kT=0.6, periodic=False):
+    """
+    This function is the batched form of `Simulation.data_to_energy`.
+    The histograms are
+    (a) smoothed along the angle axis with a Gaussian kernel with width 1;
+    (b) floored, by setting any zero value to the minimum non-zero value of the same row;
+    (c) normalized and turned into energy surfaces.
+    :param histograms: an (N, bins) array of populations
+    :param kT: a scalar, or one value per row
+    :param periodic: see `histograms_to_log_populations`
+    :return: an (N, bins) array of energies
+    """
+    log_populations = histograms_to_log_populations(histograms, periodic)
+    return -_column(kT, len(log_populations)) * log_populations
+
+
+def intrasurface_rates(surfaces, C_intrasurface, kT=0.6, load_slope=0.0):
+    """
+    This function calculates the forward (i -> i + 1) and backward (i + 1 -> i) rates between
+    adjacent bins of each surface, including the periodic boundary. The load adds a constant
+    `load_slope / bins` to every forward step, across the boundary too, as in
+    `Simulation.calculate_intrasurface_rates_with_load`.
+    :param surfaces: an (N, bins) array of energies
+    :param C_intrasurface: a scalar, or one value per row
+    :param kT: a scalar, or one value per row
+    :param load_slope: a scalar, or one value per row
+    :return: forward and backward rates, each (N, bins)
+    """
+    n, bins = surfaces.shape
+    difference = np.roll(surfaces, -1, axis=1) - surfaces + _column(load_slope, n) / bins
+    exponent = difference / (2 * _column(kT, n))
+    C = _column(C_intrasurface, n)
+    return C * np.exp(-exponent), C * np.exp(exponent)
+
+
+def intersurface_rates(unbound, bound, C_intersurface, catalytic_rate, cSubstrate, kT=0.6):
+    """
+    This function calculates the unbound to bound and bound to unbound rates of each bin, as in
+    `Simulation.calculate_intersurface_rates`.
+    :return: ub and bu rates, each (N, bins)
+    """
+    n, bins = unbound.shape
+    C = _column(C_intersurface, n)
+    bu = C * np.exp(-(unbound - bound) / _column(kT, n)) + _column(catalytic_rate, n)
+    ub = np.broadcast_to(C * _column(cSubstrate, n), (n, bins)).copy()
+    return ub, bu
+
+
+def compose_generators(rates):
+    """
+    Inject the rates into a stack of (2 * bins x 2 * bins) rate matrices with the same layout as
+    `Simulation.tm`, except the diagonal holds minus the row sum instead of one minus the scaled
+    row sum.
+    :param rates: a dictionary returned by `calculate_rates`
+    :return: an (N, 2 * bins, 2 * bins) array
+    """
+    n, bins = rates['forward_u'].shape
+    generators = np.zeros((n, 2 * bins, 2 * bins))
+    index = np.arange(bins)
+    following = np.roll(index, -1)
+    for offset, forward, backward in ((0, rates['forward_u'], rates['backward_u']),
+                                      (bins, rates['forward_b'], rates['backward_b'])):
+        generators[:, offset + index, offset + following] = forward
+        generators[:, offset + following, offset + index] = backward
+    generators[:, index, index + bins] = rates['ub']
+    generators[:, index + bins, index] = rates['bu']
+    diagonal = np.arange(2 * bins)
+    generators[:, diagonal, diagonal] = -generators.sum(axis=2)
+    return generators
+
+
+def single_precision_safe(generators, dtype=np.float64, tolerance=None):
+    """
+    Decide which rate matrices can be solved in `dtype`: those whose largest row sum times the
+    machine epsilon of `dtype` stays below the tolerance.
+    :return: an (N,) boolean array; all True without a tolerance
+    """
+    n, m, _ = generators.shape
+    if tolerance is None:
+        return np.ones(n, dtype=bool)
+    scale = np.abs(generators[:, np.arange(m), np.arange(m)]).max(axis=1)
+    return np.finfo(dtype).eps * scale <= tolerance
+
+
+def steady_states(generators, dtype=np.float64, refine=0, tolerance=None):
+    """
+    Solve p K = 0 with sum(p) = 1 for each rate matrix K in the stack. Each matrix is first divided
+    by its largest row sum, like `Simulation.scale_tm`, which leaves the steady state unchanged.
+    :param generators: an (N, M, M) array
+    :param dtype: the floating point type of the solve
+    :param refine: the number of steps of iterative refinement in float64
+    :param tolerance: if given, matrices whose largest row sum times the machine epsilon of `dtype`
+    exceeds it are solved in float64 instead
+    :return: an (N, M) array of steady-state distributions
+    """
+    n, m, _ = generators.shape
+    scale = np.abs(generators[:, np.arange(m), np.arange(m)]).max(axis=1)
+    system = np.transpose(generators, (0, 2, 1)) / scale[:, None, None]
+    # Replace the last balance equation by the normalization condition.
+    system[:, -1, :] = 1.0
+    rhs = np.zeros((n, m, 1))
+    rhs[:, -1, 0] = 1.0
+    low = single_precision_safe(generators, dtype, tolerance)
+    ss = np.empty((n, m, 1))
+    if np.any(low):
+        ss[low] = np.linalg.solve(system[low].astype(dtype), rhs[low].astype(dtype))
+    if not np.all(low):
+        ss[~low] = np.linalg.solve(system[~low], rhs[~low])
+    for _ in range(refine):
+        ss += np.linalg.solve(system, rhs - np.matmul(system, ss))
+    return ss[:, :, 0]
+
+
+def solve_accuracy(ss, generators):
+    """
+    Measure how well each steady state solves its balance equations.
+    :param ss: an (N, M) array of steady-state distributions
+    :param generators: an (N, M, M) array of rate matrices
+    :return: the residual max|p K| (per second, so it bounds the error of every flux) and the
+    normalization error |sum(p) - 1|, each (N,)
+    """
+    residual = np.abs(np.einsum('ni,nij->nj', ss, generators)).max(axis=1)
+    return residual, np.abs(ss.sum(axis=1) - 1)
+
+
+def calculate_fluxes(ss, rates):
+    """
+    This function is the batched form of `Simulation.calculate_flux`.
+    :param ss: an (N, 2 * bins) array of steady-state distributions
+    :param rates: a dictionary returned by `calculate_rates`
+    :return: flux_u, flux_b and flux_ub, each (N, bins)
+    """
+    bins = rates['forward_u'].shape[1]
+    unbound, bound = ss[:, :bins], ss[:, bins:]
+    flux_u = unbound * rates['forward_u'] - np.roll(unbound, -1, axis=1) * rates['backward_u']
+    flux_b = bound * rates['forward_b'] - np.roll(bound, -1, axis=1) * rates['backward_b']
+    flux_ub = unbound * rates['ub'] - bound * rates['bu']
+    return flux_u, flux_b, flux_ub
+
+
+def calculate_rates(unbound, bound, parameters):
+    """
+    Calculate every rate for a stack of unbound and bound energy surfaces.
+    :param unbound: an (N, bins) array of unbound energies
+    :param bound: an (N, bins) array of bound energies, already shifted by the offset
+    :param parameters: a dictionary like `Simulation.parameters()`; each value may be a scalar or
+    one value per row
+    :return: a dictionary of (N, bins) rate arrays
+    """
+    bins = unbound.shape[1]
+    kT = parameters['kT']
+    C_intrasurface = np.asarray(parameters['D'], dtype=float) / (360. / bins) ** 2
+    load_slope = parameters.get('load_slope')
+    if load_slope is None:
+        load_slope = 0.0
+    rates = {}
+    rates['forward_u'], rates['backward_u'] = intrasurface_rates(unbound, C_intrasurface, kT,
+                                                                 load_slope)
+    rates['forward_b'], rates['backward_b'] = intrasurface_rates(bound, C_intrasurface, kT,
+                                                                 load_slope)
+    rates['ub'], rates['bu'] = intersurface_rates(unbound, bound, parameters['C_intersurface'],
+                                                  parameters['catalytic_rate'],
+                                                  parameters['cSubstrate'], kT)
+    return rates
+
+
+def simulate_batch(unbound, bound, parameters, user_energies=False, chunk_size=512,
+                   profile='fast'):
+    """
+    Run the whole simulation for a stack of histogram pairs.
+    :param unbound: an (N, bins) array of unbound populations (or energies)
+    :param bound: an (N, bins) array of bound populations (or energies)
+    :param parameters: a dictionary like `Simulation.parameters()`; each value may be a scalar or
+    one value per row
+    :param user_energies: the inputs are energy surfaces; skip the preprocessing and the offset
+    :param chunk_size: the number of rate matrices that are held in memory at once
+    :param profile: one of `PROFILES`
+    :return: a dictionary with `ss`, `flux_u`, `flux_b` and `flux_ub`, the `residual`,
+    `normalization_error` and `flagged` status of every solve, and its diagnostics: `stiffness`
+    (the ratio of the largest to the smallest rate), `negative_mass` (relative to the total) and
+    `fallbacks` (1 where a single precision solve was too stiff and float64 was used)
+    """
+    settings = PROFILES[profile]
+    unbound = np.atleast_2d(np.asarray(unbound, dtype=float))
+    bound = np.atleast_2d(np.asarray(bound, dtype=float))
+    n = len(unbound)
+    if not user_energies:
+        periodic = parameters.get('periodic_smoothing', False)
+        unbound = histograms_to_energies(unbound, parameters['kT'], periodic)
+        bound = histograms_to_energies(bound, parameters['kT'], periodic) - \
+            _column(parameters['offset_factor'], n)
+    rates = calculate_rates(unbound, bound, parameters)
+    ss = np.empty((n, 2 * unbound.shape[1]))
+    residual = np.empty(n)
+    normalization_error = np.empty(n)
+    fallbacks = np.zeros(n)
+    for start in range(0, n, chunk_size):
+        chunk = {key: value[start:start + chunk_size] for key, value in rates.items()}
+        generators = compose_generators(chunk)
+        if settings['dtype'] != np.float64:
+            fallbacks[start:start + chunk_size] = ~single_precision_safe(
+                generators, settings['dtype'], settings['tolerance'])
+        ss[start:start + chunk_size] = steady_states(generators, settings['dtype'],
+                                                     settings['refine'], settings['tolerance'])
+        residual[start:start + chunk_size], normalization_error[start:start + chunk_size] = \
+            solve_accuracy(ss[start:start + chunk_size], generators)
+    flux_u, flux_b, flux_ub = calculate_fluxes(ss, rates)
+    flagged = (residual > settings['tolerance']) | (normalization_error > settings['tolerance'])
+    every_rate = np.hstack([rates[key] for key in sorted(rates)])
+    stiffness = every_rate.max(axis=1) / every_rate.min(axis=1)
+    negative_mass = np.maximum(-ss, 0).sum(axis=1) / np.abs(ss).sum(axis=1)
+    return {'ss': ss, 'flux_u': flux_u, 'flux_b': flux_b, 'flux_ub': flux_ub,
+            'residual': residual, 'normalization_error': normalization_error, 'flagged': flagged,
+            'stiffness': stiffness, 'negative_mass': negative_mass, 'fallbacks': fallbacks}
+
+
+def flux_observables(fluxes):
+    """
+    Reduce the batched fluxes to the directional, reciprocating and intersurface flux of each row,
+    defined as in `summarize_fluxes`.
+    :param fluxes: a dictionary returned by `simulate_batch`
+    :return: a dictionary of (N,) arrays
+    """
+    # The fluxes do not depend on the catalytic rate given here.
+    records = batch_observables(fluxes, np.nan)
+    return {LABELS[key]: records[key]
+            for key in ('directional_flux', 'intersurface_flux', 'driven_flux')}
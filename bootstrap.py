@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+These functions estimate the uncertainty of the fluxes that comes from the finite sampling of the
+MD histograms. Each torsion's histograms are resampled many times and all replicas are solved
+together with `batch.simulate_batch`.
+"""
+
+import numpy as np
+
+from batch import flux_observables, simulate_batch
+from scan import configure
+from simulation import Simulation
+
+
+def resample(histogram, replicas, samples=None, block_length=1, rng=None):
+    """
+    Draw bootstrap replicas of a histogram.
+    With `block_length = 1` this is a multinomial bootstrap: each replica redistributes `samples`
+    frames over the bins with the observed probabilities. With `block_length > 1`, frames are drawn
+    in blocks of `block_length` correlated frames that all fall into the same bin. This is the
+    block bootstrap of a trajectory that has been reduced to a histogram, and it widens the
+    intervals according to the correlation time of the MD.
+    :param histogram: counts, or populations if `samples` is given
+    :param replicas: the number of replicas, B
+    :param samples: the number of MD frames behind the histogram; defaults to the sum of the counts
+    :param block_length: the number of consecutive frames per block
+    :param rng: a `np.random.Generator`
+    :return: a (B, bins) array of counts
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    histogram = np.asarray(histogram, dtype=float)
+    if samples is None:
+        samples = int(round(histogram.sum()))
+        if samples < len(histogram):
+            raise ValueError('The histogram looks normalized; pass the number of frames as `samples`.')
+    probabilities = histogram / histogram.sum()
+    blocks = max(int(np.ceil(samples / float(block_length))), 1)
+    return rng.multinomial(blocks, probabilities, size=replicas) * float(block_length)
+
+
+def bootstrap_fluxes(name, data_source='adk_md_data', replicas=200, samples=None, block_length=1,
+                     confidence=0.95, parameters=None, seed=None):
+    """
+    Return bootstrap confidence intervals on the fluxes of one torsion.
+    :param name: filename of the torsion
+    :param data_source: one of the recognized protein systems in the class
+    :param replicas: the number of resampled histogram pairs
+    :param samples: the number of MD frames per histogram, if the histograms are normalized; a
+    single value or a pair (unbound, bound)
+    :param block_length: the number of correlated frames per block, see `resample`
+    :param confidence: the width of the percentile interval
+    :param parameters: a dictionary of `Simulation` attributes to override, e.g. `cSubstrate`
+    :param seed: seed for the random number generator
+    :return: a dictionary that maps each observable to its estimate, interval, replicas and
+    whether the interval excludes zero
+    """
+    this = Simulation(data_source=data_source)
+    this.name = name
+    configure(this, parameters or {})
+    this.read_populations()
+    rng = np.random.default_rng(seed)
+    unbound_samples, bound_samples = samples if np.ndim(samples) else (samples, samples)
+    unbound = np.vstack((this.unbound_population,
+                         resample(this.unbound_population, replicas, unbound_samples, block_length,
+                                  rng)))
+    bound = np.vstack((this.bound_population,
+                       resample(this.bound_population, replicas, bound_samples, block_length, rng)))
+    observables = flux_observables(simulate_batch(unbound, bound, this.parameters()))
+    tail = 100 * (1 - confidence) / 2.
+    summary = {}
+    for key, values in observables.items():
+        lower, upper = np.percentile(values[1:], [tail, 100 - tail])
+        summary[key] = {'estimate': values[0],
+                        'lower': lower,
+                        'upper': upper,
+                        'replicas': values[1:],
+                        'significant': bool(lower > 0 or upper < 0)}
+    return summary
+
+
+def bootstrap_scan(names, data_source='adk_md_data', replicas=200, samples=None, block_length=1,
+                   confidence=0.95, parameters=None, seed=None):
+    """
+    Run `bootstrap_fluxes` for several torsions and collect the intervals in a dataframe with
+    one row per torsion.
+    """
+    import pandas as pd
+    rows = []
+    rng = np.random.SeedSequence(seed)
+    for name, child in zip(names, rng.spawn(len(names))):
+        summary = bootstrap_fluxes(name, data_source=data_source, replicas=replicas,
+                                   samples=samples, block_length=block_length,
+                                   confidence=confidence, parameters=parameters,
+                                   seed=child)
+        row = {'File': name}
+        for key, values in summary.items():
+            row[key] = values['estimate']
+            row[key + ' lower'] = values['lower']
+            row[key + ' upper'] = values['upper']
+            row[key + ' significant'] = values['significant']
+        rows.append(row)
+    return pd.DataFrame(rows)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""
+This has a single class: `ResultCache`
+This class stores the steady-state distribution and fluxes calculated by `Simulation.simulate()`
+on disk, keyed by a hash of the input histograms and every model parameter, so the same torsion
+is not solved again by a different notebook or worker process.
+"""
+
+import hashlib
+import json
+import numbers
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+
+def canonical(value):
+    """
+    Convert a parameter to a plain Python value, so `np.float64(1e-3)` and `1e-3` hash the same.
+    """
+    if isinstance(value, (bool, np.bool_)) or value is None:
+        return None if value is None else bool(value)
+    if isinstance(value, numbers.Number):
+        return float(value)
+    return str(value)
+
+
+class ResultCache(object):
+    """
+    A content-addressed store of simulation results. Each entry is a compressed `.npz` file holding
+    `dt`, `ss`, `flux_u`, `flux_b` and `flux_ub`. Entries are written to a temporary file and then
+    renamed into place, so concurrent writers from a process pool never leave a partial entry
+    behind. When the cache grows beyond `max_bytes`, the least recently used entries are removed.
+    """
+
+    def __init__(self, directory='./simulation-cache', max_bytes=2 * 1024 ** 3, evict_every=32):
+        """
+        :param directory: where the entries are stored; it is created if necessary
+        :param max_bytes: the size above which the least recently used entries are removed
+        :param evict_every: check the size of the cache after about one in this many writes, counted
+        over every process that writes to the directory
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        self.evict()
+
+    @staticmethod
+    def key(unbound, bound, parameters):
+        """
+        Hash the input histograms (or energies) and the model parameters.
+        :param unbound: the unbound histogram
+        :param bound: the bound histogram
+        :param parameters: a dictionary of parameters, i.e., `Simulation.parameters()`
+        :return: a hexadecimal digest
+        """
+        digest = hashlib.sha1()
+        for array in (unbound, bound):
+            array = np.ascontiguousarray(array, dtype=float)
+            digest.update(str(array.shape).encode())
+            digest.update(array.tobytes())
+        canonical_parameters = {k: canonical(v) for k, v in parameters.items()}
+        digest.update(json.dumps(canonical_parameters, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        """
+        Entries are spread over subdirectories named by the first two characters of the key.
+        """
+        return os.path.join(self.directory, key[:2], key + '.npz')
+
+    def get(self, key):
+        """
+        Return a dictionary of the stored arrays, or `None` if the key is not in the cache.
+        """
+        path = self.path(key)
+        try:
+            with np.load(path) as stored:
+                result = {name: stored[name] for name in stored.files}
+        except (IOError, OSError, ValueError, zipfile.BadZipFile):
+            return None
+        try:
+            # Mark the entry as recently used.
+            os.utime(path, None)
+        except OSError:
+            pass
+        return result
+
+    def put(self, key, **arrays):
+        """
+        Store the arrays under the key. The entry is written atomically.
+        """
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        handle, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                np.savez_compressed(f, **{name: np.asarray(value) for name, value in arrays.items()})
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        # The keys are uniformly distributed hashes, so this picks one in `evict_every` writes of all
+        # processes together, even if each of them only writes a few entries.
+        if int(key[:8], 16) % self.evict_every == 0:
+            self.evict()
+
+    def entries(self):
+        """
+        Return a list of `(mtime, size, path)` for every entry in the cache.
+        """
+        entries = []
+        for subdirectory in os.scandir(self.directory):
+            if not subdirectory.is_dir():
+                continue
+            for entry in os.scandir(subdirectory.path):
+                if not entry.name.endswith('.npz'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    # Removed by another process in the meantime.
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        """
+        Return the total size of the cache in bytes.
+        """
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is smaller than `max_bytes`.
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self.entries())
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+"""
+A command line entry point for production runs, so they can be scheduled on batch nodes without a
+notebook. Every result is written as one line (JSON or CSV) as soon as it is finished, so the output
+can be piped, tailed or monitored while the run goes on.
+
+    python cli.py fluxes adk_md_data --torsions 'chi2*' --log-range -6 0 61 --workers 16
+    python cli.py power hiv_md_data --torsions 'chi1ALA*' --concentrations -3 --format csv
+    python cli.py sweep adk_md_data --grid catalytic_rate=10,100,312 --grid cSubstrate=1e-3 \\
+        --output sweep.jsonl
+
+The plots of `Simulation` are never drawn; matplotlib is switched to a non-interactive backend.
+"""
+
+import argparse
+import contextlib
+import csv
+import fnmatch
+import itertools
+import json
+import math
+import os
+import sys
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+import numpy as np
+
+from bank import discover_names
+from observables import LABELS, OBSERVABLES
+from results import PARAMETERS
+from scan import run
+from scheduler import Throughput, plan
+from stream import completed
+from summarize import summarize_fluxes, summarize_power_and_load
+
+QUANTITIES = ('Directional flux', 'Intersurface flux', 'Driven flux')
+
+
+def _fluxes(data_source, name, concentration, catalytic_rate):
+    # Like every task, send what the library prints to stderr, away from the records on stdout.
+    with contextlib.redirect_stdout(sys.stderr):
+        values = summarize_fluxes(name, 10 ** concentration, data_source=data_source,
+                                  catalytic_rate=catalytic_rate)
+    return dict(zip(QUANTITIES, values))
+
+
+def _power(data_source, name, concentration, catalytic_rate, negative):
+    with contextlib.redirect_stdout(sys.stderr):
+        values = summarize_power_and_load(name, 10 ** concentration, data_source=data_source,
+                                          negative=negative, catalytic_rate=catalytic_rate)
+    if values is None:
+        # The search gave up.
+        values = (None, None)
+    return {'Max power': values[0], 'Max load': values[1]}
+
+
+def _sweep(data_source, name, parameters):
+    with contextlib.redirect_stdout(sys.stderr):
+        result = run(data_source, name, parameters)
+    record = {key: result.parameters[key] for key in PARAMETERS}
+    observables = result.observables()
+    record.update({LABELS[key]: observables[key] for key in OBSERVABLES})
+    return record
+
+
+def select_torsions(data_source, patterns):
+    """
+    Return the torsions of a data source whose names match any of the glob patterns.
+    """
+    names = discover_names(data_source)
+    return [name for name in names if any(fnmatch.fnmatchcase(name, p) for p in patterns)]
+
+
+def parse_grid(items):
+    """
+    Turn `['catalytic_rate=10,100', 'cSubstrate=1e-3']` into the list of dictionaries of every
+    combination of values.
+    """
+    axes = []
+    for item in items:
+        key, values = item.split('=', 1)
+        axes.append([(key, float(value)) for value in values.split(',')])
+    return [dict(point) for point in itertools.product(*axes)]
+
+
+def _plain(value):
+    """
+    Convert numpy scalars for JSON; NaN and infinity become `null`.
+    """
+    if isinstance(value, (np.floating, float)):
+        value = float(value)
+        return value if math.isfinite(value) else None
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+
+class LineWriter(object):
+    """
+    Write records as JSON lines or CSV rows, flushing after each one.
+    """
+
+    def __init__(self, stream, format='json'):
+        self.stream = stream
+        self.format = format
+        self.writer = None
+
+    def write(self, record):
+        record = {key: _plain(value) for key, value in record.items()}
+        if self.format == 'json':
+            self.stream.write(json.dumps(record) + '\n')
+        else:
+            if self.writer is None:
+                self.writer = csv.DictWriter(self.stream, fieldnames=list(record))
+                self.writer.writeheader()
+            self.writer.writerow(record)
+        self.stream.flush()
+
+
+def _concentrations(args):
+    if args.log_range is not None:
+        start, stop, number = args.log_range
+        return list(np.round(np.linspace(start, stop, int(number)), 6))
+    return args.concentrations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run flux summaries or parameter sweeps and '
+                                                 'stream one line per result.')
+    parser.add_argument('command', choices=('fluxes', 'power', 'sweep'),
+                        help='`summarize_fluxes`, `summarize_power_and_load` or a general sweep')
+    parser.add_argument('data_source')
+    parser.add_argument('--torsions', nargs='+', default=['*'], help='glob patterns of torsions')
+    parser.add_argument('--concentrations', nargs='+', type=float, default=[-3.0],
+                        help='log10 of the substrate concentrations (M)')
+    parser.add_argument('--log-range', nargs=3, type=float, metavar=('START', 'STOP', 'NUMBER'),
+                        help='evenly spaced log10 concentrations, instead of --concentrations')
+    parser.add_argument('--catalytic-rate', type=float, default=None)
+    parser.add_argument('--negative', action='store_true', help='apply a negative load (power)')
+    parser.add_argument('--grid', action='append', default=[], metavar='KEY=V1,V2,...',
+                        help='a swept `Simulation` attribute (sweep); may be repeated')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes; 0 runs in this process; chosen from the number '
+                             'of cores by default')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='BLAS threads per worker process; the cores are shared evenly '
+                             'between the workers by default')
+    parser.add_argument('--format', choices=('json', 'csv'), default='json')
+    parser.add_argument('--output', default='-', help='a file, or - for stdout')
+    args = parser.parse_args(argv)
+
+    names = select_torsions(args.data_source, args.torsions)
+    if not names:
+        parser.error('no torsion of {} matches {}'.format(args.data_source, args.torsions))
+    if args.command == 'sweep':
+        grid = parse_grid(args.grid) or [{}]
+        if args.catalytic_rate is not None:
+            grid = [dict(point, catalytic_rate=args.catalytic_rate) for point in grid]
+        function = _sweep
+        tasks = ((args.data_source, name, point) for name in names for point in grid)
+    else:
+        function = _fluxes if args.command == 'fluxes' else _power
+        extra = (args.negative,) if args.command == 'power' else ()
+        tasks = ((args.data_source, name, concentration, args.catalytic_rate) + extra
+                 for name in names for concentration in _concentrations(args))
+
+    workers, threads = args.workers, args.threads
+    if workers is None:
+        schedule = plan(tasks=len(names) * (len(grid) if args.command == 'sweep'
+                                            else len(_concentrations(args))))
+        workers, threads = schedule['workers'], threads or schedule['threads']
+    throughput = Throughput(workers or 1, threads or 1)
+
+    stream = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    writer = LineWriter(stream, args.format)
+    try:
+        for task, values in completed(function, tasks, workers=workers, threads=threads,
+                                      throughput=throughput):
+            record = {'File': task[1]}
+            if args.command != 'sweep':
+                record['Concentration'] = task[2]
+            record.update(values)
+            writer.write(record)
+    except BrokenPipeError:
+        # The reader stopped early, e.g. `| head`; silence the final flush of stdout.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+    # Out of the way of the results on stdout.
+    print(throughput, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+A thin client of the solver server in `server.py`. It imports nothing heavier than numpy, so a new
+notebook or script can ask a running server for results without loading the simulation stack or
+reading `md-data` again.
+
+    this = RemoteSimulation(data_source='adk_md_data')
+    this.name = 'chi2THR175'
+    this.cSubstrate = 10 ** -3
+    this.simulate()
+    this.flux_u, this.observables()
+
+    with SolverClient() as client:
+        scan = client.scan('adk_md_data', names, [{'cSubstrate': c} for c in concentrations])
+"""
+
+import os
+import stat
+import tempfile
+from multiprocessing.connection import Client
+
+
+def private_directory():
+    """
+    The directory of the socket and the key of the server: `$XDG_RUNTIME_DIR/nonequilibrium`, or a
+    directory of this user in the temporary directory. It is created accessible to this user only,
+    and refused if it belongs to someone else or others may access it.
+    """
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        directory = os.path.join(runtime, 'nonequilibrium')
+    else:
+        directory = os.path.join(tempfile.gettempdir(), 'nonequilibrium-{}'.format(os.getuid()))
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError('{} is not a private directory of this user.'.format(directory))
+    return directory
+
+
+def default_address():
+    """
+    The Unix socket of the server: `$NONEQUILIBRIUM_SOCKET`, or `solver.sock` in
+    `private_directory()`.
+    """
+    return os.environ.get('NONEQUILIBRIUM_SOCKET') or os.path.join(private_directory(),
+                                                                  'solver.sock')
+
+
+def read_authkey(create=False):
+    """
+    Return the key that clients authenticate with, from the file `authkey` in
+    `private_directory()`, which only this user may read.
+    :param create: write a new random key if there is none yet, as the server does
+    """
+    path = os.path.join(private_directory(), 'authkey')
+    if create:
+        try:
+            handle = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(handle, 'wb') as f:
+                f.write(os.urandom(32))
+    with open(path, 'rb') as f:
+        info = os.fstat(f.fileno())
+        if info.st_uid != os.getuid() or info.st_mode & 0o077:
+            raise PermissionError('{} must be readable by this user only.'.format(path))
+        return f.read()
+
+
+class SolverClient(object):
+    """
+    A connection to a solver server. Every method sends one request and waits for the answer;
+    errors raised by the server are raised again here.
+    """
+
+    def __init__(self, address=None):
+        """
+        :param address: the Unix socket of the server; `default_address()` by default
+        """
+        self.address = address or default_address()
+        self.connection = Client(self.address, family='AF_UNIX', authkey=read_authkey())
+
+    def request(self, command, *arguments):
+        self.connection.send((command, arguments))
+        status, value = self.connection.recv()
+        if status == 'error':
+            raise value
+        return value
+
+    def simulate(self, data_source, name, parameters=None, profile='legacy'):
+        """
+        Simulate one torsion, like `scan.run`.
+        :return: a `SimulationResult`
+        """
+        return self.request('simulate', data_source, name, parameters or {}, profile)
+
+    def scan(self, data_source, names, grid, profile='legacy'):
+        """
+        Simulate every torsion at every grid point, like `scan.scan`.
+        :return: a `ScanResult`
+        """
+        return self.request('scan', data_source, list(names), list(grid), profile)
+
+    def names(self, data_source):
+        """
+        Return the torsions of a data source that the server has loaded.
+        """
+        return self.request('names', data_source)
+
+    def status(self):
+        """
+        Return a dictionary with the loaded data sources, the number of results kept in memory,
+        the number of requests answered from memory and the uptime of the server.
+        """
+        return self.request('status')
+
+    def shutdown(self):
+        """
+        Stop the server.
+        """
+        return self.request('shutdown')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RemoteSimulation(object):
+    """
+    A stand-in for `Simulation` whose `simulate()` is answered by the server. Set the same
+    attributes as on a `Simulation` (`name`, `cSubstrate`, `catalytic_rate`, `load_slope`, ...),
+    call `simulate()` and read `ss`, `flux_u`, `flux_b`, `flux_ub` and `dt`. Attributes that are not
+    set keep the defaults of the data source on the server. Nothing is plotted.
+    """
+
+    # Filled in by `simulate()`, and never sent to the server.
+    RESULTS = ('dt', 'ss', 'flux_u', 'flux_b', 'flux_ub', 'residual', 'normalization_error',
+               'result')
+
+    def __init__(self, data_source='adk_md_data', client=None, profile='legacy'):
+        """
+        :param data_source: one of the recognized protein systems in the class
+        :param client: a `SolverClient`; one is opened on the default address if not given
+        :param profile: the solver profile, 'legacy' or one of `batch.PROFILES`
+        """
+        self.data_source = data_source
+        self.client = client or SolverClient()
+        self.profile = profile
+        self.name = None
+        for key in self.RESULTS:
+            setattr(self, key, None)
+
+    def overrides(self):
+        """
+        Return the attributes that were set, as a dictionary for `scan.configure`.
+        """
+        skip = set(self.RESULTS) | {'data_source', 'client', 'profile', 'name'}
+        return {key: value for key, value in vars(self).items()
+                if key not in skip and not key.startswith('_')}
+
+    def simulate(self):
+        self.result = self.client.simulate(self.data_source, self.name, self.overrides(),
+                                           self.profile)
+        for key in ('dt', 'ss', 'flux_u', 'flux_b', 'flux_ub', 'residual', 'normalization_error'):
+            setattr(self, key, getattr(self.result, key))
+        return
+
+    def parameters(self):
+        """
+        The numerical parameters of the last solve, as stored in its `SimulationResult`.
+        """
+        return dict(self.result.parameters)
+
+    def diagnostics(self):
+        return dict(self.result.diagnostics)
+
+    def observables(self):
+        return self.result.observables()
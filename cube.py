@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+"""
+This has a single class: `ResultCube`
+A result cube holds one or more quantities (e.g., directional flux) on labelled axes such as
+torsion x concentration x catalytic rate x load. The values live in a `.npy` file that is opened as
+a `np.memmap`, and the axes are described in a small `.json` sidecar. Workers can fill disjoint
+slabs of the same cube concurrently, and analyses read only the parts they touch.
+"""
+
+import itertools
+import json
+import os
+
+import numpy as np
+
+from batch import flux_observables, simulate_batch
+from scan import configure, read_histograms
+from simulation import Simulation
+
+
+class ResultCube(object):
+    """
+    A memory-mapped N-D array with labelled axes. The last axis of `data` runs over `quantities`.
+    By convention the first axis is `name` (the torsions), and every other axis is named after the
+    `Simulation` attribute it sweeps, e.g. `cSubstrate`, `catalytic_rate` or `load_slope`.
+    """
+
+    def __init__(self, path, axes, quantities, data, attributes=None):
+        self.path = path
+        self.axes = axes
+        self.quantities = quantities
+        self.data = data
+        self.attributes = attributes or {}
+
+    @staticmethod
+    def _files(path):
+        return path + '.npy', path + '.json'
+
+    @classmethod
+    def create(cls, path, axes, quantities, dtype='float64', attributes=None):
+        """
+        Create an empty cube on disk. Every value is NaN until it is written.
+        :param path: the file name, without extension
+        :param axes: a list of `(name, values)` pairs
+        :param quantities: a list of quantity names, e.g. `['Directional flux', 'Driven flux']`
+        :param dtype: the dtype of the values
+        :param attributes: a dictionary of extra metadata, e.g. the data source
+        """
+        data_file, sidecar = cls._files(path)
+        axes = [(name, list(values)) for name, values in axes]
+        shape = tuple(len(values) for _, values in axes) + (len(quantities),)
+        data = np.lib.format.open_memmap(data_file, mode='w+', dtype=dtype, shape=shape)
+        data[...] = np.nan
+        data.flush()
+        metadata = {'axes': [[name, [v if isinstance(v, str) else float(v) for v in values]]
+                             for name, values in axes],
+                    'quantities': list(quantities),
+                    'attributes': attributes or {}}
+        with open(sidecar + '.tmp', 'w') as f:
+            json.dump(metadata, f, indent=1)
+        os.replace(sidecar + '.tmp', sidecar)
+        return cls(path, [(name, np.asarray(values)) for name, values in axes], list(quantities),
+                   data, attributes)
+
+    @classmethod
+    def open(cls, path, mode='r'):
+        """
+        Open an existing cube. Use `mode='r+'` in workers that write slabs.
+        """
+        data_file, sidecar = cls._files(path)
+        with open(sidecar) as f:
+            metadata = json.load(f)
+        data = np.load(data_file, mmap_mode=mode)
+        axes = [(name, np.asarray(values)) for name, values in metadata['axes']]
+        return cls(path, axes, metadata['quantities'], data, metadata['attributes'])
+
+    @property
+    def names(self):
+        return [name for name, _ in self.axes]
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def axis(self, name):
+        """
+        Return the position of an axis.
+        """
+        return self.names.index(name)
+
+    def labels(self, name):
+        """
+        Return the values along an axis.
+        """
+        return self.axes[self.axis(name)][1]
+
+    def _index(self, name, label):
+        """
+        Turn a label (or a list of labels, or a slice of positions) into a position along an axis.
+        """
+        if isinstance(label, slice):
+            return label
+        values = self.labels(name)
+        if np.ndim(label):
+            return np.array([self._index(name, item) for item in label])
+        if values.dtype.kind in 'fc':
+            matches = np.nonzero(np.isclose(values, label, rtol=1e-9, atol=0))[0]
+        else:
+            matches = np.nonzero(values == label)[0]
+        if len(matches) == 0:
+            raise KeyError('{} is not on the {} axis.'.format(label, name))
+        return int(matches[0])
+
+    def sel(self, quantity=None, **labels):
+        """
+        Select by label. Axes that are not given are kept whole. The result is a view of the
+        memory map, so nothing is read until it is used.
+        :param quantity: a quantity name; if `None`, all quantities are kept
+        :param labels: `axis=label`, `axis=[labels]` or `axis=slice(...)`
+        """
+        index = [slice(None)] * self.data.ndim
+        for name, label in labels.items():
+            index[self.axis(name)] = self._index(name, label)
+        if quantity is not None:
+            index[-1] = self.quantities.index(quantity)
+        # Apply integer arrays one at a time, so several of them do not broadcast together.
+        result = self.data[tuple(i if not isinstance(i, np.ndarray) else slice(None) for i in index)]
+        offset = 0
+        for position, i in enumerate(index):
+            if isinstance(i, np.ndarray):
+                result = np.take(result, i, axis=position - offset)
+            elif not isinstance(i, slice):
+                offset += 1
+        return result
+
+    def write(self, values, **labels):
+        """
+        Write a slab. Workers that write disjoint slabs of the same cube can run concurrently.
+        :param values: an array with the shape of `self.sel(**labels)`
+        :param labels: `axis=label` or `axis=slice(...)` for the slab
+        """
+        index = [slice(None)] * self.data.ndim
+        for name, label in labels.items():
+            index[self.axis(name)] = self._index(name, label)
+        self.data[tuple(index)] = values
+        self.data.flush()
+
+    def reduce(self, function, quantity, axis, combine=None, chunk=64, **labels):
+        """
+        Reduce along an axis, reading the cube in chunks along the first axis so that the whole
+        cube is never in memory.
+        :param function: a reduction like `np.nanmax` that accepts `axis` and `keepdims`
+        :param quantity: a quantity name
+        :param axis: the name of the axis to reduce
+        :param combine: the reduction that merges the partial results of the chunks when the first
+        axis is reduced, e.g. `np.sum` for counts; defaults to `function`
+        :param chunk: the number of rows of the first axis read at once
+        :param labels: a selection to apply before reducing; selected axes are dropped
+        """
+        position = self.axis(axis)
+        for name, label in labels.items():
+            if self.axis(name) < position and not isinstance(label, slice) and not np.ndim(label):
+                position -= 1
+        rows = len(self.labels(self.names[0]))
+        first = self.names[0]
+        parts = []
+        for start in range(0, rows, chunk):
+            selection = dict(labels)
+            if first not in labels:
+                selection[first] = slice(start, start + chunk)
+            part = function(np.asarray(self.sel(quantity, **selection)), axis=position,
+                            keepdims=True)
+            parts.append(part)
+            if first in labels:
+                break
+        if position == 0 and first not in labels:
+            result = (combine or function)(np.concatenate(parts, axis=0), axis=0, keepdims=True)
+        else:
+            result = np.concatenate(parts, axis=0)
+        return np.squeeze(result, axis=position)
+
+    def number_above_threshold(self, quantity, threshold, **labels):
+        """
+        Count the torsions whose |quantity| is above a threshold, for every point of the other axes.
+        """
+        def count(values, axis, keepdims):
+            return np.sum(np.abs(values) > threshold, axis=axis, keepdims=keepdims)
+        return self.reduce(count, quantity, 'name', combine=np.sum, **labels)
+
+    def maximum(self, quantity, axis, absolute=True, **labels):
+        """
+        Return the maximum (of the magnitude, by default) of a quantity along an axis.
+        """
+        def maximum(values, axis, keepdims):
+            return np.nanmax(np.abs(values) if absolute else values, axis=axis, keepdims=keepdims)
+        return self.reduce(maximum, quantity, axis, **labels)
+
+    def to_frame(self, **labels):
+        """
+        Return a selection as a long dataframe, with one column per axis and per quantity.
+        """
+        import pandas as pd
+        selected = np.asarray(self.sel(**labels))
+        kept = [(name, values) for name, values in self.axes
+                if name not in labels or isinstance(labels[name], slice) or np.ndim(labels[name])]
+        kept = [(name, values[labels[name]] if name in labels and isinstance(labels[name], slice)
+                 else (np.asarray(labels[name]) if name in labels else values))
+                for name, values in kept]
+        grid = list(itertools.product(*[values for _, values in kept]))
+        frame = pd.DataFrame(grid, columns=[name for name, _ in kept])
+        flat = selected.reshape(-1, len(self.quantities))
+        for i, quantity in enumerate(self.quantities):
+            frame[quantity] = flat[:, i]
+        return frame
+
+
+def fill_slab(path, start, stop, data_source=None, parameters=None):
+    """
+    Solve the torsions `start:stop` of a cube at every point of its other axes and write the slab.
+    The quantities must be among those of `batch.flux_observables`. This function opens the cube
+    itself, so it can be handed to a process pool.
+    :param path: the cube file name, without extension
+    :param start: the first torsion of the slab
+    :param stop: one past the last torsion of the slab
+    :param data_source: one of the recognized protein systems; defaults to the cube attribute
+    :param parameters: a dictionary of `Simulation` attributes that are not swept
+    """
+    cube = ResultCube.open(path, mode='r+')
+    data_source = data_source or cube.attributes['data_source']
+    names = list(cube.labels('name')[start:stop])
+    this = Simulation(data_source=data_source)
+    configure(this, parameters or {})
+    model = this.parameters()
+    swept = cube.axes[1:]
+    points = list(itertools.product(*[values for _, values in swept]))
+    unbound, bound = read_histograms(data_source, names)
+    for (name, _), values in zip(swept, zip(*points)):
+        model[name] = np.tile(np.asarray(values, dtype=float), len(names))
+    n = len(points)
+    observables = flux_observables(simulate_batch(np.repeat(unbound, n, axis=0),
+                                                  np.repeat(bound, n, axis=0), model))
+    values = np.stack([observables[quantity] for quantity in cube.quantities], axis=-1)
+    cube.write(values.reshape((len(names),) + cube.shape[1:]), name=slice(start, stop))
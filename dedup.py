@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+These functions find torsions whose smoothed unbound and bound energy surfaces are identical (or
+identical to within a tolerance), such as flat or fully rigid dihedrals, so that each distinct pair
+of surfaces is solved only once and the results are shared by every torsion that has it.
+"""
+
+import hashlib
+
+import numpy as np
+
+from batch import histograms_to_energies
+from scan import read_histograms, scan
+from simulation import Simulation
+
+
+def surface_keys(unbound, bound, kT=0.6, tolerance=0.0, periodic=False):
+    """
+    Hash the smoothed energy surfaces of each torsion.
+    :param unbound: an (N, bins) array of unbound populations
+    :param bound: an (N, bins) array of bound populations
+    :param kT: the temperature used to turn populations into energies
+    :param tolerance: if positive, energies are rounded to multiples of this (kcal/mol) before
+    hashing, so surfaces that differ by less than about `tolerance` share a key; pairs that straddle
+    a rounding boundary can still get different keys
+    :param periodic: see `batch.histograms_to_log_populations`
+    :return: a list of N hexadecimal digests
+    """
+    energies = np.hstack((histograms_to_energies(unbound, kT, periodic),
+                          histograms_to_energies(bound, kT, periodic)))
+    if tolerance > 0:
+        energies = np.round(energies / tolerance).astype(np.int64)
+    return [hashlib.sha1(np.ascontiguousarray(row).tobytes()).hexdigest() for row in energies]
+
+
+def deduplicate(keys):
+    """
+    Group equal keys.
+    :param keys: a list of N hashable keys
+    :return: the index of the first row with each distinct key, and for every row the position of
+    its key among those
+    """
+    first = {}
+    representatives = []
+    inverse = np.empty(len(keys), dtype=int)
+    for i, key in enumerate(keys):
+        if key not in first:
+            first[key] = len(representatives)
+            representatives.append(i)
+        inverse[i] = first[key]
+    return np.array(representatives, dtype=int), inverse
+
+
+def scan_deduplicated(data_source, names, grid, tolerance=0.0, cache=None, bank=None,
+                      verbose=True):
+    """
+    Like `scan.scan`, but torsions with the same surfaces are solved once.
+    :param data_source: one of the recognized protein systems in the class
+    :param names: a list of torsion filenames
+    :param grid: a list of dictionaries of `Simulation` attributes, one per grid point
+    :param tolerance: see `surface_keys`
+    :param cache: an optional `ResultCache`
+    :param bank: an optional `HistogramBank` to take the populations from
+    :param verbose: print how many solves were saved
+    :return: a `ScanResult` with the same rows as `scan.scan`, and a dictionary that reports the
+    number of torsions, distinct surface pairs and solves saved
+    """
+    unbound, bound = read_histograms(data_source, names, bank=bank)
+    this = Simulation(data_source=data_source)
+    representatives, inverse = deduplicate(surface_keys(unbound, bound, this.kT, tolerance,
+                                                        this.periodic_smoothing))
+    unique = scan(data_source, [names[i] for i in representatives], grid, cache=cache, bank=bank)
+    points = len(grid)
+    index = (inverse[:, None] * points + np.arange(points)[None, :]).ravel()
+    packed = unique.select(index)
+    packed.names = np.repeat(np.asarray(names), points)
+    report = {'torsions': len(names),
+              'unique': len(representatives),
+              'solves': len(representatives) * points,
+              'saved': (len(names) - len(representatives)) * points}
+    if verbose:
+        print('Solved {} distinct surface pairs for {} torsions; saved {} of {} solves.'.format(
+            report['unique'], report['torsions'], report['saved'], report['torsions'] * points))
+    return packed, report
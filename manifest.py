@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+This has a single class: `Manifest`
+A manifest records, for a scan saved on disk, a content hash of every input histogram and of every
+parameter set behind its rows, together with the summaries and Chimera files derived from it.
+`incremental_scan` uses it to recompute only the torsions whose inputs changed, and then patches
+the derived outputs in place.
+
+    packed, changed = incremental_scan('adk-scan', 'adk_md_data', names, grid)
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from cache import canonical
+from results import ScanResult
+from scan import scan
+from simulation import Simulation
+
+
+def input_hash(data_source, name):
+    """
+    Hash the contents of the unbound and bound histogram files of a torsion.
+    :return: a hexadecimal digest, or `None` if the data source has no files
+    """
+    this = Simulation(data_source=data_source)
+    this.name = name
+    files = this.population_files()
+    if files is None:
+        return None
+    digest = hashlib.sha1()
+    for path in files[:2]:
+        try:
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        except IOError:
+            digest.update(b'missing')
+    return digest.hexdigest()
+
+
+def parameter_hash(parameters):
+    """
+    Hash a dictionary of `Simulation` attributes.
+    """
+    canonical_parameters = {key: canonical(value) for key, value in parameters.items()}
+    return hashlib.sha1(json.dumps(canonical_parameters, sort_keys=True).encode()).hexdigest()
+
+
+class Manifest(object):
+    """
+    The dependency record of a scan saved as `path + '.npz'`. It is stored as
+    `path + '.manifest.json'`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data_source = None
+        self.inputs = {}
+        self.rows = []
+        self.outputs = []
+
+    @property
+    def filename(self):
+        return self.path + '.manifest.json'
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read the manifest of a scan, or start an empty one.
+        """
+        manifest = cls(path)
+        if os.path.exists(manifest.filename):
+            with open(manifest.filename) as f:
+                stored = json.load(f)
+            manifest.data_source = stored['data_source']
+            manifest.inputs = stored['inputs']
+            manifest.rows = [tuple(row) for row in stored['rows']]
+            manifest.outputs = stored['outputs']
+        return manifest
+
+    def save(self):
+        with open(self.filename + '.tmp', 'w') as f:
+            json.dump({'data_source': self.data_source,
+                       'inputs': self.inputs,
+                       'rows': [list(row) for row in self.rows],
+                       'outputs': self.outputs}, f, indent=1)
+        os.replace(self.filename + '.tmp', self.filename)
+
+    def register_output(self, kind, path, **options):
+        """
+        Record a summary derived from the scan, so that it is patched whenever the scan changes.
+        :param kind: 'table' for a pickled scan dataframe, or 'chimera' for a Chimera attribute file
+        written like `data_frame_to_chimera`
+        :param path: the file name (without `.dat` for Chimera files)
+        :param options: for 'chimera', `column`, `concentration` (log10) and `label`
+        """
+        output = dict(options, kind=kind, path=path)
+        self.outputs = [o for o in self.outputs if o['path'] != path] + [output]
+
+
+def _patch_table(output, frame, changed):
+    """
+    Replace the rows of the changed torsions in a pickled scan table.
+    """
+    import pandas as pd
+    if os.path.exists(output['path']):
+        table = pd.read_pickle(output['path'])
+        table = table[~table['File'].isin(changed)]
+        table = pd.concat([table, frame[frame['File'].isin(changed)]], ignore_index=True)
+    else:
+        table = frame
+    table.to_pickle(output['path'])
+
+
+def _patch_chimera(output, frame, changed):
+    """
+    Rewrite the lines of the residues with changed torsions in a Chimera attribute file.
+    The value of a residue is the largest |column| over its torsions, as in `data_frame_to_chimera`.
+    """
+    column = output['column']
+    tmp = frame[np.round(frame['Concentration'], 1) == np.round(output['concentration'], 1)]
+    residues = tmp['ResID'].astype(int)
+    file = str(output['path']) + '.dat'
+
+    def line(i):
+        return '\t:{}\t{}\n'.format(i, np.max(abs(tmp[residues == i][column])))
+
+    if not os.path.exists(file):
+        lines = ['attribute: {}\n'.format(output['label']), 'match mode: any\n',
+                 'recipient: residues\n']
+        lines += [line(i) for i in range(min(residues), max(residues) + 1)]
+    else:
+        with open(file) as f:
+            lines = f.readlines()
+        touched = set(int(resid) for resid in frame[frame['File'].isin(changed)]['ResID'])
+        for index, text in enumerate(lines):
+            if text.startswith('\t:') and int(text.split()[0][1:]) in touched:
+                lines[index] = line(int(text.split()[0][1:]))
+    with open(file + '.tmp', 'w') as f:
+        f.writelines(lines)
+    os.replace(file + '.tmp', file)
+
+
+def incremental_scan(path, data_source, names, grid, cache=None, bank=None):
+    """
+    Bring the scan saved at `path + '.npz'` up to date. Only torsions whose histogram files changed,
+    or that are missing rows for some grid point, are simulated again; every other row is copied
+    from the previous result. Registered outputs are then patched for the changed torsions, or
+    written in full if they do not exist yet.
+    :param path: the scan file name, without extension
+    :param data_source: one of the recognized protein systems in the class
+    :param names: a list of torsion filenames
+    :param grid: a list of dictionaries of `Simulation` attributes, one per grid point
+    :param cache: an optional `ResultCache`
+    :param bank: an optional `HistogramBank` to take the populations from
+    :return: the up-to-date `ScanResult` and the list of torsions that were recomputed
+    """
+    manifest = Manifest.load(path)
+    hashes = {name: input_hash(data_source, name) for name in names}
+    points = [parameter_hash(dict(parameters, data_source=data_source)) for parameters in grid]
+    previous = None
+    known = {}
+    if manifest.data_source == data_source and os.path.exists(path + '.npz'):
+        previous = ScanResult.load(path + '.npz')
+        known = {row: i for i, row in enumerate(manifest.rows)}
+    changed = [name for name in names
+               if manifest.inputs.get(name) != hashes[name]
+               or any((name, point) not in known for point in points)]
+    parts = [previous] if previous is not None else []
+    fresh = {}
+    if changed:
+        offset = len(previous) if previous is not None else 0
+        parts.append(scan(data_source, changed, grid, cache=cache, bank=bank))
+        for i, name in enumerate(changed):
+            for j, point in enumerate(points):
+                fresh[(name, point)] = offset + i * len(points) + j
+    rows = [(name, point) for name in names for point in points]
+    index = [fresh[row] if row in fresh else known[row] for row in rows]
+    packed = ScanResult.concatenate(parts).select(np.array(index, dtype=int))
+    packed.save(path + '.tmp.npz')
+    os.replace(path + '.tmp.npz', path + '.npz')
+    manifest.data_source = data_source
+    manifest.inputs = hashes
+    manifest.rows = rows
+    manifest.save()
+    frame = None
+    for output in manifest.outputs:
+        target = output['path'] + ('.dat' if output['kind'] == 'chimera' else '')
+        # Outputs that do not exist yet are written in full.
+        stale = changed if os.path.exists(target) else list(names)
+        if not stale:
+            continue
+        if frame is None:
+            frame = packed.to_frame()
+        if output['kind'] == 'table':
+            _patch_table(output, frame, stale)
+        elif output['kind'] == 'chimera':
+            _patch_chimera(output, frame, stale)
+    return packed, changed
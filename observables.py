@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+These functions compute every standard summary of a solve at once: the directional, intersurface
+and driven (reciprocating) flux as in `summarize_fluxes`, the velocity (bound population times the
+catalytic rate) as in `return_fluxes_and_velocity`, and the bound and apo populations. They work on
+one solve or on many, and many solves come back together as one structured array, so a torsion and
+concentration never has to be solved again just to get another quantity.
+
+    this.simulate()
+    record = this.observables()
+    record['velocity']
+
+    records = scan(...).observables()
+    frame = observables_frame(records)
+"""
+
+import numpy as np
+
+# The fields of every record, in order.
+OBSERVABLES = ('directional_flux', 'intersurface_flux', 'driven_flux', 'velocity',
+               'bound_population', 'apo_population')
+
+# The column names used in the scan tables.
+LABELS = {'directional_flux': 'Directional flux',
+          'intersurface_flux': 'Intersurface flux',
+          'driven_flux': 'Driven flux',
+          'velocity': 'Velocity',
+          'bound_population': 'Bound population',
+          'apo_population': 'Apo population'}
+
+
+def observable_dtype():
+    return np.dtype([(key, float) for key in OBSERVABLES])
+
+
+def extract(ss, flux_u, flux_b, flux_ub, catalytic_rate):
+    """
+    Compute every observable of many solves.
+    :param ss: an (N, 2 * bins) array of steady-state distributions, unbound surface first
+    :param flux_u: an (N, bins) array of unbound fluxes
+    :param flux_b: an (N, bins) array of bound fluxes
+    :param flux_ub: an (N, bins) array of intersurface fluxes
+    :param catalytic_rate: the catalytic rate (per second), a scalar or one per solve
+    :return: an (N,) structured array with one field per entry of `OBSERVABLES`
+    """
+    ss = np.atleast_2d(ss)
+    flux_u = np.atleast_2d(flux_u)
+    flux_b = np.atleast_2d(flux_b)
+    flux_ub = np.atleast_2d(flux_ub)
+    bins = flux_u.shape[1]
+    records = np.empty(len(ss), dtype=observable_dtype())
+    records['directional_flux'] = np.mean(flux_u + flux_b, axis=1)
+    records['intersurface_flux'] = np.max(np.abs(flux_ub), axis=1)
+    records['driven_flux'] = np.maximum(np.max(np.abs(flux_u), axis=1),
+                                        np.max(np.abs(flux_b), axis=1))
+    records['apo_population'] = np.sum(ss[:, :bins], axis=1)
+    records['bound_population'] = np.sum(ss[:, bins:], axis=1)
+    records['velocity'] = records['bound_population'] * np.asarray(catalytic_rate, dtype=float)
+    return records
+
+
+def batch_observables(fluxes, catalytic_rate):
+    """
+    Compute every observable of the rows of a batch.
+    :param fluxes: a dictionary returned by `batch.simulate_batch`
+    :param catalytic_rate: the catalytic rate (per second), a scalar or one per row
+    :return: an (N,) structured array, see `extract`
+    """
+    return extract(fluxes['ss'], fluxes['flux_u'], fluxes['flux_b'], fluxes['flux_ub'],
+                   catalytic_rate)
+
+
+def observables_frame(records, names=None):
+    """
+    Turn records returned by `extract` into a dataframe with the column names of the scan tables.
+    :param records: a structured array of observables
+    :param names: an optional list of torsion names, one per record, for a 'File' column
+    """
+    import pandas as pd
+    frame = pd.DataFrame({LABELS[key]: records[key] for key in OBSERVABLES})
+    if names is not None:
+        frame.insert(0, 'File', np.asarray(names))
+    return frame
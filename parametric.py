@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+These functions scan a parameter that enters the rates linearly, such as `D` (which scales every
+intrasurface rate), `C_intersurface`, `cSubstrate` or `catalytic_rate`. The rate matrix is then a
+pencil K(s) = A + s B in the swept value s, and so are the balance equations p K(s) = 0 together
+with the normalization sum(p) = 1. The pencil is reduced once by the generalized Schur (QZ)
+decomposition, A = Q S Z^H and B = Q T Z^H with S and T upper triangular, after which the steady
+state at each s costs one triangular solve, (S + s T) y = Q^H e and p = Z y, instead of a full
+factorization.
+
+    scan = parametric_scan('adk_md_data', names, 'D', np.logspace(10, 14, 41))
+"""
+
+import numpy as np
+from scipy.linalg import qz, solve_triangular
+
+from batch import PROFILES, calculate_fluxes, calculate_rates, compose_generators, \
+    histograms_to_energies, solve_accuracy
+from results import PARAMETERS, ScanResult
+from scan import configure, read_histograms
+from simulation import Simulation
+
+
+def linear_rates(unbound, bound, parameters, key, values):
+    """
+    Split every rate into r(s) = r0 + s r1, where s is the value of the parameter `key`, and check
+    that the split holds at the ends of the scan.
+    :param unbound: an (N, bins) array of unbound energies
+    :param bound: an (N, bins) array of bound energies, already shifted by the offset
+    :param parameters: a dictionary like `Simulation.parameters()`
+    :param key: the swept parameter
+    :param values: the values of the scan
+    :return: two dictionaries of (N, bins) rate arrays, the constant part and the slope
+    """
+    def rates(value):
+        # A parameter like `kT` is meaningless at zero; the check below rejects it.
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            return calculate_rates(unbound, bound, dict(parameters, **{key: value}))
+
+    constant = rates(0.0)
+    # The slope from the far end of the scan, where it is least affected by rounding.
+    reference = float(np.max(np.abs(values))) or 1.0
+    slope = {name: (rate - constant[name]) / reference
+             for name, rate in rates(reference).items()}
+    if not any(np.any(rate != 0) for rate in slope.values()):
+        raise ValueError('The rates do not depend on {}.'.format(key))
+    for value in (np.min(values), reference / 2.):
+        for name, rate in rates(value).items():
+            if not np.allclose(constant[name] + value * slope[name], rate, rtol=1e-6, atol=0):
+                raise ValueError('The rates are not linear in {}.'.format(key))
+    return constant, slope
+
+
+class Pencil(object):
+    """
+    The balance equations of the rate matrices A + s B, with the last one replaced by the
+    normalization condition, reduced once by the QZ decomposition.
+    """
+
+    def __init__(self, A, B, scale=1.0):
+        """
+        :param A: the constant part of the rate matrix
+        :param B: the part proportional to s
+        :param scale: the balance equations are divided by this, usually the largest row sum of
+        the rate matrices of the scan, so they are comparable to the normalization condition
+        """
+        m = A.shape[0]
+        self.a = A.T / scale
+        self.b = B.T / scale
+        self.a[-1, :] = 1.0
+        self.b[-1, :] = 0.0
+        self.rhs = np.zeros(m)
+        self.rhs[-1] = 1.0
+        self.S, self.T, self.Q, self.Z = qz(self.a, self.b, output='complex')
+        self.Qh = self.Q.conj().T
+
+    def _solve(self, triangular, rhs):
+        return self.Z.dot(solve_triangular(triangular, self.Qh.dot(rhs)))
+
+    def solve(self, s, refine=2):
+        """
+        Return the steady state at s, and the largest imaginary part of the solution relative to
+        its size (zero in exact arithmetic).
+        :param s: the value of the swept parameter
+        :param refine: the number of steps of iterative refinement against the full system
+        """
+        # The factors at s serve the solve and every refinement step; the residual of the full
+        # system is taken from A and B without forming A + s B.
+        triangular = self.S + s * self.T
+        solution = self._solve(triangular, self.rhs)
+        imaginary_part = np.max(np.abs(solution.imag)) / np.max(np.abs(solution))
+        ss = solution.real
+        for _ in range(refine):
+            residual = self.rhs - self.a.dot(ss) - s * self.b.dot(ss)
+            ss += self._solve(triangular, residual).real
+        return ss, imaginary_part
+
+
+def parametric_scan(data_source, names, key, values, parameters=None, bank=None, refine=2,
+                    tolerance=None):
+    """
+    Simulate every torsion at every value of a parameter that enters the rates linearly.
+    :param data_source: one of the recognized protein systems in the class
+    :param names: a list of torsion filenames
+    :param key: the swept parameter, e.g. 'D', 'C_intersurface', 'cSubstrate' or 'catalytic_rate'
+    :param values: the values of the parameter
+    :param parameters: a dictionary of other `Simulation` attributes to override
+    :param bank: an optional `HistogramBank` to take the populations from
+    :param refine: the number of steps of iterative refinement of each steady state
+    :param tolerance: the largest acceptable residual; by default that of the 'exact' profile. The
+    number of values above it is reported, and `result.flagged(tolerance)` selects them.
+    :return: a `ScanResult` with `len(names) * len(values)` rows, ordered by torsion then value;
+    `dt` is NaN, since no transition matrix is scaled
+    """
+    if tolerance is None:
+        tolerance = PROFILES['exact']['tolerance']
+    this = Simulation(data_source=data_source)
+    configure(this, parameters or {})
+    model = this.parameters()
+    unbound, bound = read_histograms(data_source, names, bank=bank)
+    unbound = histograms_to_energies(unbound, this.kT, this.periodic_smoothing)
+    bound = histograms_to_energies(bound, this.kT, this.periodic_smoothing) - this.offset_factor
+    values = np.asarray(values, dtype=float)
+    n, k = len(names), len(values)
+    ss, flux_u, flux_b, flux_ub, residual, normalization_error = [], [], [], [], [], []
+    diagnostics = np.full(n * k, np.nan, dtype=ScanResult.diagnostic_dtype())
+    for row in range(n):
+        constant, slope = linear_rates(unbound[row:row + 1], bound[row:row + 1], model, key,
+                                       values)
+        A = compose_generators(constant)[0]
+        B = compose_generators(slope)[0]
+        generators = A[None, :, :] + values[:, None, None] * B[None, :, :]
+        m = A.shape[0]
+        scale = np.abs(generators[:, np.arange(m), np.arange(m)]).max()
+        pencil = Pencil(A, B, scale)
+        solutions = [pencil.solve(s, refine) for s in values]
+        torsion = np.array([solution[0] for solution in solutions])
+        rates = {name: constant[name] + values[:, None] * slope[name] for name in constant}
+        fluxes = calculate_fluxes(torsion, rates)
+        accuracy = solve_accuracy(torsion, generators)
+        rows = slice(row * k, (row + 1) * k)
+        diagnostics['imaginary_part'][rows] = [solution[1] for solution in solutions]
+        diagnostics['negative_mass'][rows] = np.maximum(-torsion, 0).sum(axis=1) / \
+            np.abs(torsion).sum(axis=1)
+        every_rate = np.hstack([rates[name] for name in sorted(rates)])
+        diagnostics['stiffness'][rows] = every_rate.max(axis=1) / every_rate.min(axis=1)
+        ss.append(torsion)
+        flux_u.append(fluxes[0])
+        flux_b.append(fluxes[1])
+        flux_ub.append(fluxes[2])
+        residual.append(accuracy[0])
+        normalization_error.append(accuracy[1])
+    stored = np.empty(n * k, dtype=ScanResult.parameter_dtype())
+    for name in PARAMETERS:
+        value = model[name]
+        stored[name] = np.nan if value is None else value
+    stored[key] = np.tile(values, n)
+    result = ScanResult(data_source, np.repeat(np.asarray(names), k), stored,
+                        np.full(n * k, np.nan), np.vstack(ss), np.vstack(flux_u),
+                        np.vstack(flux_b), np.vstack(flux_ub), np.concatenate(residual),
+                        np.concatenate(normalization_error), diagnostics)
+    flagged = result.flagged(tolerance)
+    if np.any(flagged):
+        print('{} of {} steady states have a residual above {:g}, up to {:g}.'.format(
+            np.sum(flagged), len(result), tolerance, np.max(result.residual)))
+    return result
@@ -418,11 +418,10 @@ def return_fluxes_and_velocity(protein, name, concentrations, catalytic_rate=Non
         if catalytic_rate:
             this.catalytic_rate = catalytic_rate
         this.simulate()
-        directional_flux.append(np.mean(this.flux_u + this.flux_b))
-        reciprocating_flux.append(
-                np.max(np.hstack((abs(this.flux_u), abs(this.flux_b)))))
-        velocity.append(
-                np.sum(this.ss[this.bins:2 * this.bins]) * this.catalytic_rate)
+        record = this.observables()
+        directional_flux.append(record['directional_flux'])
+        reciprocating_flux.append(record['driven_flux'])
+        velocity.append(record['velocity'])
     return directional_flux, reciprocating_flux, velocity
 
 
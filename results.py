@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+"""
+This has two classes: `SimulationResult` and `ScanResult`
+`SimulationResult` holds only what the summaries need from a single `Simulation`: the fluxes,
+the steady-state distribution, `dt` and the parameters. `ScanResult` packs many of these into
+contiguous arrays, so a full protein by concentration scan is cheap to keep in memory.
+"""
+
+import re
+
+import numpy as np
+
+from observables import LABELS, extract
+
+# The numerical parameters that are stored for every result, in the order of `Simulation.parameters()`.
+# `periodic_smoothing` is stored as 0 or 1.
+PARAMETERS = ('kT', 'D', 'C_intersurface', 'offset_factor', 'catalytic_rate', 'cSubstrate',
+              'load_slope', 'periodic_smoothing')
+
+# The numerical health of every solve, see `Simulation.diagnostics()`. `overflow` is 0 or 1 and
+# `fallbacks` is the number of solver fallbacks taken.
+DIAGNOSTICS = ('stiffness', 'imaginary_part', 'negative_mass', 'overflow', 'fallbacks')
+
+
+def _diagnostic_values(diagnostics):
+    """
+    Turn a dictionary like `Simulation.diagnostics()` into a tuple of `DIAGNOSTICS`, with NaN for
+    anything unknown.
+    """
+    diagnostics = diagnostics or {}
+    values = []
+    for key in DIAGNOSTICS:
+        value = diagnostics.get(key)
+        if key == 'fallbacks' and isinstance(value, list):
+            value = len(value)
+        values.append(np.nan if value is None else float(value))
+    return tuple(values)
+
+
+class SimulationResult(object):
+    """
+    A lightweight record of a single simulation.
+    """
+    __slots__ = ('data_source', 'name', 'parameters', 'dt', 'ss', 'flux_u', 'flux_b', 'flux_ub',
+                 'residual', 'normalization_error', 'diagnostics')
+
+    def __init__(self, data_source, name, parameters, dt, ss, flux_u, flux_b, flux_ub,
+                 residual=None, normalization_error=None, diagnostics=None):
+        self.data_source = data_source
+        self.name = name
+        self.parameters = parameters
+        self.dt = dt
+        self.ss = ss
+        self.flux_u = flux_u
+        self.flux_b = flux_b
+        self.flux_ub = flux_ub
+        self.residual = residual
+        self.normalization_error = normalization_error
+        # A dictionary with the entries of `DIAGNOSTICS`.
+        self.diagnostics = diagnostics
+
+    @classmethod
+    def from_simulation(cls, this):
+        """
+        Keep the results of a `Simulation` and drop everything else (transition matrix,
+        eigenvalues, populations, energies and colours).
+        :param this: an object of class Simulation, after `simulate()`
+        """
+        parameters = this.parameters()
+        return cls(this.data_source, this.name,
+                   {key: parameters[key] for key in PARAMETERS},
+                   this.dt, this.ss, this.flux_u, this.flux_b, this.flux_ub,
+                   this.residual, this.normalization_error,
+                   dict(zip(DIAGNOSTICS, _diagnostic_values(this.diagnostics()))))
+
+    @property
+    def bins(self):
+        return len(self.flux_u)
+
+    def observables(self):
+        """
+        Return every standard summary of this result as one record, see `observables.extract`.
+        """
+        return extract(self.ss, self.flux_u, self.flux_b, self.flux_ub,
+                       self.parameters['catalytic_rate'])[0]
+
+    def __repr__(self):
+        return '<SimulationResult {} {} cSubstrate={}>'.format(
+            self.data_source, self.name, self.parameters.get('cSubstrate'))
+
+
+class ScanResult(object):
+    """
+    Many simulation results, packed into contiguous arrays. Row `i` of every array belongs to
+    the same simulation.
+    """
+
+    def __init__(self, data_source, names, parameters, dt, ss, flux_u, flux_b, flux_ub,
+                 residual=None, normalization_error=None, diagnostics=None):
+        """
+        :param data_source: the data source of the scan
+        :param names: an array of torsion names, one per row
+        :param parameters: a structured array with one field per entry of `PARAMETERS`
+        :param dt: an array of time steps
+        :param ss: an (N, 2 * bins) array of steady-state distributions
+        :param flux_u: an (N, bins) array of unbound fluxes
+        :param flux_b: an (N, bins) array of bound fluxes
+        :param flux_ub: an (N, bins) array of intersurface fluxes
+        :param residual: an array of steady-state residuals max|p K|; NaN where unknown
+        :param normalization_error: an array of |sum(p) - 1|; NaN where unknown
+        :param diagnostics: a structured array with one field per entry of `DIAGNOSTICS`; NaN
+        where unknown
+        """
+        self.data_source = data_source
+        self.names = np.asarray(names)
+        self.parameters = parameters
+        self.dt = np.ascontiguousarray(dt, dtype=float)
+        self.ss = np.ascontiguousarray(ss, dtype=float)
+        self.flux_u = np.ascontiguousarray(flux_u, dtype=float)
+        self.flux_b = np.ascontiguousarray(flux_b, dtype=float)
+        self.flux_ub = np.ascontiguousarray(flux_ub, dtype=float)
+        self.residual = np.full(len(self.names), np.nan) if residual is None else \
+            np.ascontiguousarray(residual, dtype=float)
+        self.normalization_error = np.full(len(self.names), np.nan) \
+            if normalization_error is None else np.ascontiguousarray(normalization_error,
+                                                                    dtype=float)
+        if diagnostics is None:
+            diagnostics = np.full(len(self.names), np.nan, dtype=self.diagnostic_dtype())
+        self.diagnostics = diagnostics
+
+    @staticmethod
+    def parameter_dtype():
+        return np.dtype([(key, float) for key in PARAMETERS])
+
+    @staticmethod
+    def diagnostic_dtype():
+        return np.dtype([(key, float) for key in DIAGNOSTICS])
+
+    @classmethod
+    def from_results(cls, results, data_source=None):
+        """
+        Pack a list of `SimulationResult` into contiguous arrays.
+        """
+        if data_source is None and len(results):
+            data_source = results[0].data_source
+        parameters = np.empty(len(results), dtype=cls.parameter_dtype())
+        diagnostics = np.empty(len(results), dtype=cls.diagnostic_dtype())
+        for i, result in enumerate(results):
+            parameters[i] = tuple(np.nan if result.parameters[key] is None else result.parameters[key]
+                                  for key in PARAMETERS)
+            diagnostics[i] = _diagnostic_values(result.diagnostics)
+        return cls(data_source,
+                   [result.name for result in results],
+                   parameters,
+                   [result.dt for result in results],
+                   np.vstack([result.ss for result in results]),
+                   np.vstack([result.flux_u for result in results]),
+                   np.vstack([result.flux_b for result in results]),
+                   np.vstack([result.flux_ub for result in results]),
+                   [np.nan if result.residual is None else result.residual
+                    for result in results],
+                   [np.nan if result.normalization_error is None else result.normalization_error
+                    for result in results],
+                   diagnostics)
+
+    @classmethod
+    def concatenate(cls, parts):
+        """
+        Join several `ScanResult` of the same data source, row after row.
+        """
+        return cls(parts[0].data_source,
+                   np.concatenate([part.names.astype(str) for part in parts]),
+                   np.concatenate([part.parameters for part in parts]),
+                   np.concatenate([part.dt for part in parts]),
+                   np.vstack([part.ss for part in parts]),
+                   np.vstack([part.flux_u for part in parts]),
+                   np.vstack([part.flux_b for part in parts]),
+                   np.vstack([part.flux_ub for part in parts]),
+                   np.concatenate([part.residual for part in parts]),
+                   np.concatenate([part.normalization_error for part in parts]),
+                   np.concatenate([part.diagnostics for part in parts]))
+
+    @property
+    def bins(self):
+        return self.flux_u.shape[1]
+
+    @property
+    def concentrations(self):
+        return self.parameters['cSubstrate']
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        """
+        Return a `SimulationResult` whose arrays are views into the packed arrays.
+        """
+        parameters = {key: float(self.parameters[key][index]) for key in PARAMETERS}
+        return SimulationResult(self.data_source, str(self.names[index]), parameters,
+                                float(self.dt[index]), self.ss[index], self.flux_u[index],
+                                self.flux_b[index], self.flux_ub[index],
+                                float(self.residual[index]),
+                                float(self.normalization_error[index]),
+                                {key: float(self.diagnostics[key][index]) for key in DIAGNOSTICS})
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def select(self, mask):
+        """
+        Return a new `ScanResult` with the rows selected by a boolean mask or an index array.
+        """
+        return ScanResult(self.data_source, self.names[mask], self.parameters[mask], self.dt[mask],
+                          self.ss[mask], self.flux_u[mask], self.flux_b[mask], self.flux_ub[mask],
+                          self.residual[mask], self.normalization_error[mask],
+                          self.diagnostics[mask])
+
+    def flagged(self, tolerance):
+        """
+        Return a boolean mask of the rows whose residual or normalization error is above the
+        tolerance, or unknown.
+        """
+        return ~((self.residual <= tolerance) & (self.normalization_error <= tolerance))
+
+    def observables(self):
+        """
+        Return every standard summary of every row as a structured array, see
+        `observables.extract`.
+        """
+        return extract(self.ss, self.flux_u, self.flux_b, self.flux_ub,
+                       self.parameters['catalytic_rate'])
+
+    def to_frame(self):
+        """
+        Return a scan table with one row per simulation and the same columns as the
+        concentration-scan pickles: 'Concentration' (log10), 'File', 'ResID' and the fluxes, plus
+        one column per parameter.
+        """
+        import pandas as pd
+        records = self.observables()
+        frame = pd.DataFrame({LABELS[key]: records[key]
+                              for key in ('directional_flux', 'intersurface_flux', 'driven_flux')})
+        frame['File'] = self.names
+        frame['ResID'] = [re.match('.*?([0-9]+)$', str(name)).group(1) for name in self.names]
+        frame['Concentration'] = np.log10(self.concentrations)
+        frame['Residual'] = self.residual
+        frame['Normalization error'] = self.normalization_error
+        for key in self.parameters.dtype.names:
+            frame[key] = self.parameters[key]
+        return frame
+
+    def diagnostics_frame(self):
+        """
+        Return a table with one row per simulation of its parameters and numerical health: 'dt',
+        'Residual', 'Normalization error' and one column per entry of `DIAGNOSTICS`.
+        """
+        import pandas as pd
+        frame = pd.DataFrame({'File': self.names, 'dt': self.dt, 'Residual': self.residual,
+                              'Normalization error': self.normalization_error})
+        for key in PARAMETERS:
+            frame[key] = self.parameters[key]
+        for key in DIAGNOSTICS:
+            frame[key] = self.diagnostics[key]
+        return frame
+
+    def health(self, by='File', tolerance=None):
+        """
+        Aggregate the numerical health of the scan, to see which torsions (or parameter values)
+        are expensive or unstable.
+        :param by: the column, or list of columns, of `diagnostics_frame` to group by, e.g. 'File'
+        or 'cSubstrate'
+        :param tolerance: if given, also count the rows flagged at this tolerance
+        :return: a dataframe with one row per group: the number of solves, the smallest `dt`, the
+        largest stiffness, residual, normalization error, imaginary part and negative mass, and the
+        number of row-sum overflows and fallbacks; sorted by residual, worst first
+        """
+        frame = self.diagnostics_frame()
+        if tolerance is not None:
+            frame['flagged'] = self.flagged(tolerance)
+        aggregation = {'dt': 'min', 'stiffness': 'max', 'Residual': 'max',
+                       'Normalization error': 'max', 'imaginary_part': 'max',
+                       'negative_mass': 'max', 'overflow': 'sum', 'fallbacks': 'sum'}
+        if tolerance is not None:
+            aggregation['flagged'] = 'sum'
+        grouped = frame.groupby(by)
+        summary = grouped.agg(aggregation)
+        summary.insert(0, 'solves', grouped.size())
+        return summary.sort_values('Residual', ascending=False)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.names, self.parameters, self.dt, self.ss,
+                                              self.flux_u, self.flux_b, self.flux_ub,
+                                              self.residual, self.normalization_error,
+                                              self.diagnostics))
+
+    def save(self, filename):
+        """
+        Write the packed arrays to a single `.npz` file.
+        """
+        np.savez(filename, data_source=np.array(self.data_source), names=self.names.astype(str),
+                 parameters=self.parameters, dt=self.dt, ss=self.ss, flux_u=self.flux_u,
+                 flux_b=self.flux_b, flux_ub=self.flux_ub, residual=self.residual,
+                 normalization_error=self.normalization_error, diagnostics=self.diagnostics)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Read a `ScanResult` written by `save`. Files written before the accuracy, the diagnostics
+        or some of the `PARAMETERS` were recorded get NaN instead.
+        """
+        with np.load(filename) as stored:
+            accuracy = [stored[key] if key in stored.files else None
+                        for key in ('residual', 'normalization_error', 'diagnostics')]
+            parameters = stored['parameters']
+            if parameters.dtype.names != PARAMETERS:
+                parameters = np.full(len(parameters), np.nan, dtype=cls.parameter_dtype())
+                for key in stored['parameters'].dtype.names:
+                    if key in PARAMETERS:
+                        parameters[key] = stored['parameters'][key]
+            return cls(str(stored['data_source']), stored['names'], parameters,
+                       stored['dt'], stored['ss'], stored['flux_u'], stored['flux_b'],
+                       stored['flux_ub'], *accuracy)
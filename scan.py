@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""
+These functions run many simulations (torsions by concentrations, or any other parameter) and
+return the results as compact records instead of full `Simulation` objects.
+"""
+
+import numpy as np
+
+from bank import read_populations
+from batch import PROFILES, histograms_to_energies, simulate_batch
+from observables import batch_observables
+from simulation import Simulation
+from results import PARAMETERS, SimulationResult, ScanResult
+
+
+def configure(this, parameters):
+    """
+    Set the attributes of a `Simulation` from a dictionary of parameters. Setting `load_slope`
+    also switches on the applied load.
+    :param this: an object of class Simulation
+    :param parameters: a dictionary, e.g. `{'cSubstrate': 10**-3, 'catalytic_rate': 200}`
+    """
+    for key, value in parameters.items():
+        if value is None:
+            continue
+        setattr(this, key, value)
+        if key == 'load_slope' and value != 0:
+            this.load = True
+
+
+def run(data_source, name, parameters=None, cache=None, bank=None, profile='legacy'):
+    """
+    Simulate one torsion and return a `SimulationResult`.
+    :param data_source: one of the recognized protein systems in the class
+    :param name: filename of the torsion
+    :param parameters: a dictionary of `Simulation` attributes to override
+    :param cache: an optional `ResultCache`
+    :param bank: an optional `HistogramBank` to take the populations from
+    :param profile: the solver profile, 'legacy' or one of `batch.PROFILES`
+    :return: a `SimulationResult`
+    """
+    this = Simulation(data_source=data_source)
+    this.name = name
+    this.cache = cache
+    this.bank = bank
+    this.profile = profile
+    configure(this, parameters or {})
+    this.simulate()
+    return SimulationResult.from_simulation(this)
+
+
+def scan(data_source, names, grid, cache=None, progress=False, bank=None, profile='legacy'):
+    """
+    Simulate every torsion at every point of a parameter grid. The populations of each torsion are
+    read from disk once and reused for all of its grid points; every grid point starts from the
+    defaults of the data source, like `run`.
+    :param data_source: one of the recognized protein systems in the class
+    :param names: a list of torsion filenames
+    :param grid: a list of dictionaries of `Simulation` attributes, one per grid point
+    :param cache: an optional `ResultCache`
+    :param progress: show a progress bar over the torsions
+    :param bank: an optional `HistogramBank` to take the populations from
+    :param profile: the solver profile, 'legacy' or one of `batch.PROFILES`
+    :return: a `ScanResult` with `len(names) * len(grid)` rows, ordered by torsion then grid point
+    """
+    if progress:
+        from tqdm import tqdm
+        names = tqdm(names)
+    results = []
+    for name in names:
+        if bank is not None:
+            populations = bank.populations(name)
+        else:
+            populations = [rows[0] for rows in read_populations(data_source, [name])]
+        for parameters in grid:
+            # A new `Simulation` for every point, so nothing set by the previous point carries over.
+            this = Simulation(data_source=data_source)
+            this.name = name
+            this.cache = cache
+            this.bank = bank
+            this.profile = profile
+            this.unbound_population, this.bound_population = populations
+            configure(this, parameters)
+            this.simulate(user_populations=True)
+            results.append(SimulationResult.from_simulation(this))
+            del this
+    return ScanResult.from_results(results, data_source=data_source)
+
+
+def rerun_flagged(result, tolerance=None, profile='exact', cache=None, bank=None):
+    """
+    Simulate again, with a more accurate profile, the rows of a scan whose residual or
+    normalization error is above the tolerance, e.g. after a 'screen' sweep. A rerun only replaces
+    its row if it lowers the residual.
+    :param result: a `ScanResult`
+    :param tolerance: the largest acceptable residual; by default that of the 'screen' profile
+    :param profile: the solver profile of the reruns
+    :param cache: an optional `ResultCache`
+    :param bank: an optional `HistogramBank` to take the populations from
+    :return: a `ScanResult` with the same rows, and the indices of the rows that were replaced
+    """
+    if tolerance is None:
+        tolerance = PROFILES['screen']['tolerance']
+    results = list(result)
+    replaced = []
+    for row in np.flatnonzero(result.flagged(tolerance)):
+        parameters = {key: None if np.isnan(result.parameters[key][row])
+                      else float(result.parameters[key][row]) for key in PARAMETERS}
+        if parameters['periodic_smoothing'] is not None:
+            parameters['periodic_smoothing'] = bool(parameters['periodic_smoothing'])
+        rerun = run(result.data_source, str(result.names[row]), parameters, cache=cache,
+                    bank=bank, profile=profile)
+        # A row without a residual (e.g. from an old file) is always replaced.
+        if np.isnan(results[row].residual) or rerun.residual < results[row].residual:
+            results[row] = rerun
+            replaced.append(row)
+    return ScanResult.from_results(results, data_source=result.data_source), \
+        np.array(replaced, dtype=int)
+
+
+def scan_concentrations(data_source, names, concentrations, catalytic_rate=None, cache=None,
+                        progress=False):
+    """
+    Simulate every torsion at every substrate concentration.
+    :param data_source: one of the recognized protein systems in the class
+    :param names: a list of torsion filenames
+    :param concentrations: a list of concentrations (M)
+    :param catalytic_rate: override the default catalytic rate of the data source
+    :param cache: an optional `ResultCache`
+    :param progress: show a progress bar over the torsions
+    :return: a `ScanResult`
+    """
+    grid = [{'cSubstrate': concentration, 'catalytic_rate': catalytic_rate}
+            for concentration in concentrations]
+    return scan(data_source, names, grid, cache=cache, progress=progress)
+
+
+def adaptive_concentration_scan(data_source, name, log_min=-6, log_max=0, initial_points=9,
+                                tolerance=0.01, atol=1e-2, min_spacing=0.01, max_points=200,
+                                catalytic_rate=None, parameters=None):
+    """
+    Return the directional flux, reciprocating flux and velocity of a torsion over a non-uniform
+    concentration grid. The scan starts from `initial_points` evenly spaced in log10(concentration)
+    and bisects the intervals next to every point where any of the three quantities is further
+    than `tolerance` times its range (or `atol`, whichever is larger) from the straight line
+    through its neighbours, until no interval needs refining. Each refinement round is solved as
+    one batch. Plateaus and straight stretches keep the coarse spacing, while bends get resolved
+    down to `min_spacing` decades; a quantity that is only noise, with a range below `atol`, does
+    not cause any refinement.
+    :param data_source: one of the recognized protein systems in the class
+    :param name: filename of the torsion
+    :param log_min: log10 of the lowest concentration (M)
+    :param log_max: log10 of the highest concentration (M)
+    :param initial_points: the number of points of the starting grid
+    :param tolerance: the largest allowed deviation from linear interpolation, relative to the
+    range of each quantity
+    :param atol: the deviation (per second) that is always allowed, for all three quantities or
+    as a sequence of one value per quantity
+    :param min_spacing: intervals narrower than this (in decades) are not bisected
+    :param max_points: stop refining once the grid holds this many points
+    :param catalytic_rate: override the default catalytic rate of the data source
+    :param parameters: a dictionary of other `Simulation` attributes to override
+    :return: concentrations, directional flux, reciprocating flux and velocity, as arrays sorted by
+    concentration, in the same form as `return_fluxes_and_velocity`
+    """
+    this = Simulation(data_source=data_source)
+    this.name = name
+    configure(this, dict(parameters or {}, catalytic_rate=catalytic_rate))
+    unbound, bound = read_populations(data_source, [name])
+    unbound = histograms_to_energies(unbound[0], this.kT, this.periodic_smoothing)
+    bound = histograms_to_energies(bound[0], this.kT, this.periodic_smoothing) - this.offset_factor
+    model = this.parameters()
+
+    def evaluate(log_concentrations):
+        n = len(log_concentrations)
+        model['cSubstrate'] = 10 ** log_concentrations
+        fluxes = simulate_batch(np.repeat(unbound, n, axis=0), np.repeat(bound, n, axis=0), model,
+                                user_energies=True)
+        records = batch_observables(fluxes, this.catalytic_rate)
+        return np.column_stack((records['directional_flux'], records['driven_flux'],
+                                records['velocity']))
+
+    grid = np.linspace(log_min, log_max, initial_points)
+    values = evaluate(grid)
+    while len(grid) < max_points:
+        limit = np.maximum(tolerance * np.ptp(values, axis=0), atol)
+        # The distance of every inner point from the line through its neighbours, in units of the
+        # limit; an interval is as bad as the worse of its two ends.
+        weight = ((grid[1:-1] - grid[:-2]) / (grid[2:] - grid[:-2]))[:, None]
+        deviation = np.abs(values[1:-1] - (1 - weight) * values[:-2] - weight * values[2:])
+        deviation = np.max(deviation / limit, axis=1)
+        error = np.zeros(len(grid) - 1)
+        error[:-1] = deviation
+        error[1:] = np.maximum(error[1:], deviation)
+        refine = (error > 1) & (np.diff(grid) > min_spacing)
+        if not np.any(refine):
+            break
+        # Refine the worst intervals first, if the budget does not allow all of them.
+        order = np.argsort(-error[refine])[:max_points - len(grid)]
+        midpoints = ((grid[:-1] + grid[1:]) / 2.)[refine][order]
+        grid = np.concatenate((grid, midpoints))
+        values = np.vstack((values, evaluate(midpoints)))
+        order = np.argsort(grid)
+        grid, values = grid[order], values[order]
+    return 10 ** grid, values[:, 0], values[:, 1], values[:, 2]
+
+
+def read_histograms(data_source, names, bank=None):
+    """
+    Read the unbound and bound population histograms of several torsions.
+    :param data_source: one of the recognized protein systems in the class
+    :param names: a list of torsion filenames
+    :param bank: an optional `HistogramBank` to take the populations from
+    :return: two (N, bins) arrays
+    :raises IOError: if the histograms of a torsion cannot be read
+    """
+    if bank is not None:
+        return bank.rows(names)
+    unbound, bound = read_populations(data_source, names)
+    return np.array(unbound, dtype=float), np.array(bound, dtype=float)
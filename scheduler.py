@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+These functions split the cores of a node between worker processes and the BLAS threads inside
+each of them. `np.linalg.eig` and the other dense solves run on a multithreaded BLAS, which by
+default starts one thread per core in every process; a pool with one worker per core then runs
+cores x cores threads and slows down instead of scaling. A rate matrix of the default 2 x 60 states
+is far too small to gain anything from threading, so the scheduler prefers many single-threaded
+workers and only gives threads to each process when the matrices are large or there are fewer
+tasks than cores.
+
+    schedule = plan(bins=60, tasks=len(names) * len(grid))
+    for task, result in completed(run, tasks, **schedule):
+        ...
+
+Each worker limits its own thread pools as it starts, with `threadpoolctl`. Without
+`threadpoolctl` a forked worker would keep the BLAS thread pool of the parent, since BLAS reads the
+usual environment variables only when it is loaded. The workers are then spawned instead, with
+the variables set while they start, and a warning is printed; scripts that start them need an
+`if __name__ == '__main__':` guard, and every worker imports the simulation stack again.
+"""
+
+import contextlib
+import importlib.util
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+# The variables read by OpenBLAS, MKL, BLIS, Accelerate and OpenMP when they are loaded.
+THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                    'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+# Below about this many states per thread, a dense solve is faster on fewer threads.
+STATES_PER_THREAD = 256
+
+# The cost of a task besides its dense solves (building the matrices in Python, reading the
+# histograms, pickling the result), in floating point operations of about the same time.
+TASK_OVERHEAD = 1e8
+
+# Below about this many floating point operations per worker (about half a second), starting a
+# worker costs more than the work it takes over.
+MIN_WORK_PER_WORKER = 1e9
+
+
+def available_cores():
+    """
+    Return the number of cores this process may run on, which on a shared node can be fewer than
+    `os.cpu_count()`.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def plan(bins=60, tasks=None, batch_size=1, cores=None):
+    """
+    Choose the number of worker processes and BLAS threads per process, so that together they
+    use every core once.
+    :param bins: the number of bins per surface; every rate matrix has `2 * bins` states
+    :param tasks: the number of tasks that will be submitted, if known
+    :param batch_size: the number of rate matrices solved per task
+    :param cores: the number of cores to use; all available cores by default
+    :return: a dictionary with `workers` and `threads`, to pass to `stream.completed`
+    """
+    cores = cores or available_cores()
+    states = 2 * bins
+    # The most threads one dense solve can use well.
+    useful = max(1, states // STATES_PER_THREAD)
+    threads = min(useful, cores)
+    workers = max(1, cores // threads)
+    if tasks is not None:
+        # A dense eigendecomposition takes about 10 n^3 operations.
+        work = tasks * (10. * batch_size * states ** 3 + TASK_OVERHEAD)
+        workers = max(1, min(workers, tasks, int(work // MIN_WORK_PER_WORKER)))
+        # Cores left over by too few tasks go to the threads of each worker.
+        threads = max(threads, min(useful, cores // workers))
+    return {'workers': workers, 'threads': threads}
+
+
+def limit_threads(threads):
+    """
+    Limit the BLAS and OpenMP thread pools of this process. Used as the initializer of the workers;
+    the environment variables only reach libraries that the worker loads afterwards.
+    """
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(limits=threads)
+
+
+@contextlib.contextmanager
+def thread_environment(threads):
+    """
+    Set the thread variables for the processes started in this block, and restore them after.
+    """
+    saved = {variable: os.environ.get(variable) for variable in THREAD_VARIABLES}
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+    try:
+        yield
+    finally:
+        for variable, value in saved.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+
+
+def worker_context():
+    """
+    Return the multiprocessing context for workers whose threads are limited: the default one if
+    `threadpoolctl` is installed, otherwise 'spawn', with a warning.
+    """
+    if importlib.util.find_spec('threadpoolctl') is not None:
+        return multiprocessing.get_context()
+    print('threadpoolctl is not installed, so the BLAS threads of forked workers cannot be '
+          'limited; spawning the workers instead. Install threadpoolctl to fork them.',
+          file=sys.stderr)
+    return multiprocessing.get_context('spawn')
+
+
+def start_pool(workers, threads):
+    """
+    Start a `ProcessPoolExecutor` whose workers run `threads` BLAS threads each. Every worker is
+    started before this returns, so spawned workers see the thread variables, which are set in this
+    process only meanwhile.
+    :param workers: the number of worker processes
+    :param threads: the number of BLAS threads per worker
+    """
+    context = worker_context()
+    with thread_environment(threads):
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                       initializer=limit_threads, initargs=(threads,))
+        # A spawned worker is only started when a task is submitted and no worker is idle.
+        wait([executor.submit(os.getpid) for _ in range(workers)])
+    return executor
+
+
+class Throughput(object):
+    """
+    Count finished tasks against the wall clock.
+    """
+
+    def __init__(self, workers=1, threads=1):
+        self.workers = workers
+        self.threads = threads
+        self.tasks = 0
+        self.start = time.time()
+
+    def add(self, tasks=1):
+        self.tasks += tasks
+
+    @property
+    def elapsed(self):
+        return time.time() - self.start
+
+    @property
+    def rate(self):
+        """
+        Tasks per second.
+        """
+        elapsed = self.elapsed
+        return self.tasks / elapsed if elapsed > 0 else float('nan')
+
+    def __str__(self):
+        return 'Finished {} tasks in {:.1f} s: {:.2f} per second on {} processes x {} ' \
+               'BLAS threads.'.format(self.tasks, self.elapsed, self.rate, self.workers,
+                                      self.threads)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""
+This has a single class: `SolverServer`
+A long-running local process that imports the simulation stack once, loads the histograms of the
+configured data sources into `HistogramBank`s, keeps recent results in memory (and optionally in a
+`ResultCache` on disk), and answers simulate and scan requests from `client.py` over a Unix socket.
+Every notebook and script of a session can then share one warm engine:
+
+    python server.py adk_md_data hiv_md_data --cache ./simulation-cache &
+
+The socket is created in `client.private_directory()`, which only the user that started the server
+can enter, and clients must also present the random key that the server keeps in the file
+`authkey` there.
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+from bank import HistogramBank
+from cache import ResultCache, canonical
+from client import default_address, read_authkey
+from scan import run, scan
+
+
+class SolverServer(object):
+    """
+    Answers the requests of `SolverClient`s, one thread per connection.
+    """
+
+    def __init__(self, data_sources, address=None, cache=None, memory=4096):
+        """
+        :param data_sources: the data sources whose histograms are loaded at start
+        :param address: the Unix socket to listen on; `client.default_address()` by default
+        :param cache: an optional `ResultCache` shared with other processes
+        :param memory: the number of recent `SimulationResult`s kept in memory
+        """
+        self.address = address or default_address()
+        self.authkey = read_authkey(create=True)
+        self.cache = cache
+        self.memory = memory
+        self.results = collections.OrderedDict()
+        self.hits = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.banks = {data_source: HistogramBank.load(data_source) for data_source in data_sources}
+        self.listener = None
+        self.running = False
+
+    def names(self, data_source):
+        bank = self.banks.get(data_source)
+        return [] if bank is None else list(bank.names)
+
+    def simulate(self, data_source, name, parameters, profile):
+        key = json.dumps([data_source, name, profile,
+                          sorted((k, canonical(v)) for k, v in parameters.items())])
+        with self.lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                self.hits += 1
+                return self.results[key]
+        result = run(data_source, name, parameters, cache=self.cache,
+                     bank=self.banks.get(data_source), profile=profile)
+        with self.lock:
+            self.results[key] = result
+            while len(self.results) > self.memory:
+                self.results.popitem(last=False)
+        return result
+
+    def scan(self, data_source, names, grid, profile):
+        return scan(data_source, names, grid, cache=self.cache, bank=self.banks.get(data_source),
+                    profile=profile)
+
+    def status(self):
+        return {'data_sources': {data_source: len(bank) for data_source, bank in
+                                 self.banks.items()},
+                'results in memory': len(self.results),
+                'requests': self.requests,
+                'hits': self.hits,
+                'uptime': time.time() - self.start}
+
+    def answer(self, command, arguments):
+        self.requests += 1
+        if command == 'simulate':
+            return self.simulate(*arguments)
+        if command == 'scan':
+            return self.scan(*arguments)
+        if command == 'names':
+            return self.names(*arguments)
+        if command == 'status':
+            return self.status()
+        if command == 'shutdown':
+            self.running = False
+            # Wake up `accept` so the main loop can stop.
+            threading.Thread(target=self._wake, daemon=True).start()
+            return True
+        raise ValueError('Unknown request {!r}.'.format(command))
+
+    def _wake(self):
+        try:
+            Client(self.address, family='AF_UNIX', authkey=self.authkey).close()
+        except OSError:
+            pass
+
+    def handle(self, connection):
+        with connection:
+            while True:
+                try:
+                    command, arguments = connection.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    reply = ('ok', self.answer(command, arguments))
+                except Exception as error:
+                    reply = ('error', error)
+                connection.send(reply)
+
+    def serve(self):
+        """
+        Listen until a client asks the server to shut down.
+        """
+        if os.path.exists(self.address):
+            try:
+                Client(self.address, family='AF_UNIX', authkey=self.authkey).close()
+            except OSError:
+                # Left behind by a server that did not stop cleanly.
+                os.remove(self.address)
+            except AuthenticationError:
+                # A server that was started with another key.
+                raise RuntimeError('A server is already listening on {}.'.format(self.address))
+            else:
+                raise RuntimeError('A server is already listening on {}.'.format(self.address))
+        # The socket is accessible to this user only from the moment it is created.
+        mask = os.umask(0o077)
+        try:
+            self.listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        finally:
+            os.umask(mask)
+        self.running = True
+        print('Serving {} on {}.'.format(', '.join(self.banks) or 'no data source', self.address))
+        try:
+            while self.running:
+                try:
+                    connection = self.listener.accept()
+                except AuthenticationError:
+                    # A client without the key.
+                    continue
+                if not self.running:
+                    connection.close()
+                    break
+                threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+        for bank in self.banks.values():
+            bank.unlink()
+        self.banks = {}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve simulations over a Unix socket.')
+    parser.add_argument('data_sources', nargs='*', default=['adk_md_data'])
+    parser.add_argument('--socket', default=None, help='the Unix socket to listen on')
+    parser.add_argument('--cache', default=None, help='a `ResultCache` directory')
+    parser.add_argument('--memory', type=int, default=4096,
+                        help='the number of results kept in memory')
+    args = parser.parse_args()
+    server = SolverServer(args.data_sources, address=args.socket,
+                          cache=ResultCache(args.cache) if args.cache else None,
+                          memory=args.memory)
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+"""
+These functions split a scan into shards in a queue directory on a shared filesystem, so that
+independent worker processes on any node can run it without a message broker.
+
+The queue directory holds
+    pending/    shards waiting for a worker,
+    claimed/    shards that a worker is running,
+    done/       shards that are finished,
+    results/    one `ScanResult` per finished shard.
+A worker claims a shard by renaming it from `pending/` to `claimed/`; the rename is atomic, so
+exactly one worker wins. While it runs, the worker touches its claim every few seconds. A claim
+that has not been touched for `timeout` seconds belongs to a dead worker and is moved back to
+`pending/`. Results are written to a temporary file and renamed into place, so a shard that
+ends up being run twice just writes the same result twice.
+
+Workers can be started on each node with
+    python shards.py ./queue --workers 8
+which by default starts one single-threaded worker per core, see `scheduler.plan`.
+"""
+
+import glob
+import json
+import os
+import socket
+import threading
+import time
+
+import numpy as np
+
+from results import ScanResult
+from scan import scan
+from scheduler import available_cores, limit_threads, plan, thread_environment, worker_context
+
+FOLDERS = ('pending', 'claimed', 'done', 'results')
+
+
+def _plain(value):
+    """
+    Convert numpy scalars to the Python values JSON can hold; everything else (numbers, strings
+    such as `'profile': 'fast'`, bools and `None`) is kept as it is.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def create_queue(directory, data_source, names, grid, names_per_shard=10, points_per_shard=None):
+    """
+    Write the shards of a scan into a queue directory.
+    :param directory: the queue directory, on a filesystem that every node can see
+    :param data_source: one of the recognized protein systems in the class
+    :param names: a list of torsion filenames
+    :param grid: a list of dictionaries of `Simulation` attributes, one per grid point
+    :param names_per_shard: the number of torsions per shard
+    :param points_per_shard: the number of grid points per shard; all of them by default
+    :return: the number of shards
+    """
+    for folder in FOLDERS:
+        os.makedirs(os.path.join(directory, folder), exist_ok=True)
+    points_per_shard = points_per_shard or len(grid)
+    count = 0
+    for start in range(0, len(names), names_per_shard):
+        for first in range(0, len(grid), points_per_shard):
+            shard = {'data_source': data_source,
+                     'names': list(names[start:start + names_per_shard]),
+                     'grid': [{key: _plain(value) for key, value in point.items()}
+                              for point in grid[first:first + points_per_shard]]}
+            path = os.path.join(directory, 'pending', '{:06d}.json'.format(count))
+            with open(path + '.tmp', 'w') as f:
+                json.dump(shard, f)
+            os.replace(path + '.tmp', path)
+            count += 1
+    return count
+
+
+def _shard_id(path):
+    return os.path.basename(path).split('.')[0]
+
+
+def requeue_stale(directory, timeout=600):
+    """
+    Move claims that have not been touched for `timeout` seconds back to `pending/`.
+    :return: the number of shards that were requeued
+    """
+    requeued = 0
+    now = time.time()
+    for path in glob.glob(os.path.join(directory, 'claimed', '*')):
+        try:
+            if now - os.path.getmtime(path) < timeout:
+                continue
+            os.rename(path, os.path.join(directory, 'pending', _shard_id(path) + '.json'))
+            requeued += 1
+        except OSError:
+            # Finished or requeued by someone else in the meantime.
+            continue
+    return requeued
+
+
+def claim(directory, worker):
+    """
+    Claim one pending shard.
+    :return: the path of the claim, or `None` if nothing is pending
+    """
+    for path in sorted(glob.glob(os.path.join(directory, 'pending', '*.json'))):
+        claimed = os.path.join(directory, 'claimed', _shard_id(path) + '.' + worker)
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            # Another worker was faster.
+            continue
+        # The rename keeps the old modification time; start the clock now.
+        os.utime(claimed, None)
+        return claimed
+    return None
+
+
+class _Heartbeat(threading.Thread):
+    """
+    Touch a claim every `interval` seconds until stopped.
+    """
+
+    def __init__(self, path, interval):
+        super(_Heartbeat, self).__init__()
+        self.daemon = True
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                os.utime(self.path, None)
+            except OSError:
+                return
+
+    def stop(self):
+        self.stopped.set()
+
+
+def run_shard(directory, claimed, cache=None, heartbeat=10):
+    """
+    Run a claimed shard, write its result and mark it done.
+    """
+    shard_id = _shard_id(claimed)
+    result = os.path.join(directory, 'results', shard_id + '.npz')
+    if not os.path.exists(result):
+        with open(claimed) as f:
+            shard = json.load(f)
+        beat = _Heartbeat(claimed, heartbeat)
+        beat.start()
+        try:
+            packed = scan(shard['data_source'], shard['names'], shard['grid'], cache=cache)
+        finally:
+            beat.stop()
+        tmp = os.path.join(directory, 'results', shard_id + '.{}.tmp.npz'.format(os.getpid()))
+        packed.save(tmp)
+        os.replace(tmp, result)
+    try:
+        os.rename(claimed, os.path.join(directory, 'done', shard_id + '.json'))
+    except OSError:
+        # The claim went stale and was requeued while we were running; the result is written
+        # already, so whoever picks it up next will only mark it done.
+        pass
+
+
+def status(directory):
+    """
+    Return the number of pending, claimed and done shards.
+    """
+    return {folder: len(glob.glob(os.path.join(directory, folder, '*')))
+            for folder in ('pending', 'claimed', 'done')}
+
+
+def work(directory, worker=None, timeout=600, poll=5, cache=None):
+    """
+    Claim and run shards until the whole queue is done. While other workers still hold claims,
+    wait for them, so that their shards are retried here if they die.
+    :param directory: the queue directory
+    :param worker: a name for this worker; defaults to host name and process id
+    :param timeout: seconds after which an untouched claim is considered stale
+    :param poll: seconds to wait between looks at the queue when nothing is pending
+    :param cache: an optional `ResultCache`
+    :return: the number of shards that this worker ran
+    """
+    worker = worker or '{}-{}'.format(socket.gethostname(), os.getpid())
+    ran = 0
+    while True:
+        requeue_stale(directory, timeout)
+        claimed = claim(directory, worker)
+        if claimed is None:
+            if status(directory)['claimed'] == 0:
+                return ran
+            time.sleep(poll)
+            continue
+        run_shard(directory, claimed, cache=cache, heartbeat=max(timeout / 10., 0.1))
+        ran += 1
+
+
+def _worker(directory, timeout, threads):
+    """
+    Run `work` in a worker process of `python shards.py`, with its BLAS threads limited.
+    """
+    limit_threads(threads)
+    return work(directory, timeout=timeout)
+
+
+def merge(directory):
+    """
+    Assemble the results of every shard into one scan table, with the same columns as the
+    concentration-scan pickles: 'Concentration' (log10), 'File', 'ResID' and the fluxes,
+    plus one column per swept parameter.
+    :return: a dataframe
+    """
+    import pandas as pd
+    frames = []
+    for path in sorted(glob.glob(os.path.join(directory, 'results', '*.npz'))):
+        if '.tmp.' in path:
+            continue
+        frames.append(ScanResult.load(path).to_frame())
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the shards of a queue directory.')
+    parser.add_argument('directory')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='the number of worker processes; one per core by default')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='the number of BLAS threads per worker')
+    parser.add_argument('--timeout', type=float, default=600)
+    args = parser.parse_args()
+    workers = args.workers or plan()['workers']
+    threads = args.threads or max(1, available_cores() // workers)
+    context = worker_context()
+    processes = [context.Process(target=_worker, args=(args.directory, args.timeout, threads))
+                 for _ in range(workers)]
+    # Spawned workers take the thread variables from the environment they start in.
+    with thread_environment(threads):
+        for process in processes:
+            process.start()
+    for process in processes:
+        process.join()
+    print(status(args.directory))
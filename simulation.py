@@ -9,10 +9,14 @@ import math as math
 import matplotlib.pyplot as plt
 import numpy as np
 import scipy as sc
+import scipy.sparse as sparse
 import seaborn as sns
 from matplotlib.gridspec import GridSpec
 from scipy.ndimage.filters import gaussian_filter
+from scipy.sparse.linalg import ArpackError, ArpackNoConvergence, splu
 from aesthetics import paper_plot
+from batch import PROFILES, calculate_fluxes, calculate_rates
+from observables import extract
 
 class Simulation(object):
     """
@@ -81,11 +85,54 @@ class Simulation(object):
         # transition matrix.
         self.eigenvalues = None
         self.ss = None
+        # With the 'partial' eigensolver, only the `modes` slowest relaxation modes (and the
+        # steady state) are computed, with a sparse solver, instead of the full dense spectrum.
+        self.eigensolver = 'dense'
+        self.modes = 5
+        # The relaxation times (s) of the slowest modes, slowest first, and the spectral gap; None
+        # after a direct solve with the 'dense' eigensolver, which computes no eigenvalues.
+        self.relaxation_times = None
+        self.spectral_gap = None
+        # The solver profile: 'legacy' computes the eigenvectors of the transition matrix, as the
+        # published results did; the profiles of `batch.PROFILES` ('exact', 'fast' and 'screen')
+        # solve for the steady state directly. 'legacy' is not held to a tolerance.
+        self.profile = 'legacy'
+        # With the 'generator' pipeline, the rates are kept as a sparse rate matrix and the
+        # steady state and fluxes are computed from it directly, without the transition matrix
+        # and its time step (`dt` is NaN); the steady state is always solved for directly, in the
+        # precision of `self.profile`.
+        self.pipeline = 'transition'
+        self.rates = None
+        self.rate_generator = None
+        # How well the steady state solves the balance equations, and whether that is within
+        # the tolerance of the profile.
+        self.residual = None
+        self.normalization_error = None
+        self.flagged = None
+        # Numerical health of the last solve: the ratio of the largest to the smallest rate, the
+        # largest imaginary part and the negative mass of the steady-state eigenvector (relative
+        # to its size), whether scaling by `dt` left row sums above 1, and the solver fallbacks
+        # that were taken.
+        self.stiffness = None
+        self.imaginary_part = None
+        self.negative_mass = None
+        self.overflow = None
+        self.fallbacks = []
         # The surface fluxes are calculated using the rates and the
         # populations.
         self.flux_u = None
         self.flux_b = None
         self.flux_ub = None
+        # An optional `ResultCache` that stores the steady state and fluxes on disk, so the
+        # same torsion and parameters are not solved twice.
+        self.cache = None
+        # An optional `HistogramBank` to take the populations from instead of reading them
+        # from disk.
+        self.bank = None
+
+        # The histograms are smoothed with reflecting edges, as in the published results, unless
+        # this is set; the angle is periodic, so wrapping around is more faithful.
+        self.periodic_smoothing = False
 
         # By default, we run without any applied load on the motor.
         self.load = False
@@ -96,23 +143,37 @@ class Simulation(object):
 
 
 
+    def parameters(self):
+        """
+        This function returns every model parameter that enters the result of `simulate()`.
+        """
+        return {'data_source': self.data_source,
+                'name': self.name,
+                'kT': self.kT,
+                'D': self.D,
+                'C_intersurface': getattr(self, 'C_intersurface', None),
+                'offset_factor': getattr(self, 'offset_factor', None),
+                'catalytic_rate': getattr(self, 'catalytic_rate', None),
+                'cSubstrate': getattr(self, 'cSubstrate', None),
+                'load': self.load,
+                'load_slope': self.load_slope,
+                'periodic_smoothing': self.periodic_smoothing}
+
     def data_to_energy(self, histogram):
         """
         This function takes in population histograms from Chris' PKA data and
-        (a) smooths them with a Gaussian kernel with width 1;
+        (a) smooths them with a Gaussian kernel with width 1 (across the periodic boundary if
+        `self.periodic_smoothing` is set);
         (b) eliminates zeros by setting any zero value to the minimum of the data;
         (c) turns the population histograms to energy surfaces.
         """
 
-        histogram_smooth = gaussian_filter(histogram, 1)
-        histogram_copy = np.copy(histogram_smooth)
-        for i in range(len(histogram)):
-            if histogram_smooth[i] != 0:
-                histogram_copy[i] = histogram_smooth[i]
-            else:
-                histogram_copy[i] = min(
-                    histogram_smooth[np.nonzero(histogram_smooth)])
-        histogram_smooth = histogram_copy
+        if self.periodic_smoothing:
+            histogram_smooth = gaussian_filter(histogram, 1, mode='wrap')
+        else:
+            histogram_smooth = gaussian_filter(histogram, 1)
+        histogram_smooth = np.where(histogram_smooth != 0, histogram_smooth,
+                                    min(histogram_smooth[np.nonzero(histogram_smooth)]))
         assert not np.any(histogram_smooth == 0)
         histogram_smooth = histogram_smooth / np.sum(histogram_smooth)
         energy = -self.kT * np.log(histogram_smooth)
@@ -210,9 +271,31 @@ class Simulation(object):
         for i in range(self.bins):
             tm[i, i + self.bins] = ub_rm[i]
             tm[i + self.bins, i] = bu_rm[i]
+        rates = tm[tm > 0]
+        self.stiffness = rates.max() / rates.min()
         self.tm = self.scale_tm(tm)
         return
 
+    def compose_generator(self):
+        """
+        The rates of the 'generator' pipeline: every rate is computed as in the rate matrices of
+        `compose_tm`, kept as an edge list in `self.rates` (see `batch.calculate_rates`) and
+        assembled into a sparse rate matrix with minus the row sums on the diagonal. Nothing is
+        scaled by `dt`.
+        """
+        from spectrum import sparse_generator
+        parameters = dict(self.parameters(), load_slope=self.load_slope if self.load else 0.0)
+        self.rates = calculate_rates(np.atleast_2d(self.unbound), np.atleast_2d(self.bound),
+                                     parameters)
+        self.rate_generator = sparse_generator(self.rates)
+        rates = np.hstack([self.rates[key][0] for key in sorted(self.rates)])
+        self.stiffness = rates.max() / rates.min()
+        self.tm = None
+        self.dt = np.nan
+        self.overflow = False
+        self.eigenvalues = None
+        return
+
     def scale_tm(self, tm):
         """
         The transition matrix is scaled by `dt` so all rows sum to 1 and
@@ -226,7 +309,8 @@ class Simulation(object):
         self.dt = 10 ** -(maximum_row_sum + 1)
         tm_scaled = self.dt * tm
         row_sums = tm_scaled.sum(axis=1, keepdims=True)
-        if np.any(row_sums > 1):
+        self.overflow = bool(np.any(row_sums > 1))
+        if self.overflow:
             print('Row sums unexpectedly greater than 1.')
         for i in range(2 * self.bins):
             tm_scaled[i][i] = 1.0 - row_sums[i]
@@ -236,11 +320,185 @@ class Simulation(object):
         """
         The eigenvectors and eigenvalues of the transition matrix are computed and the steady-state population is
         assigned to the eigenvector with an eigenvalue of 1.
+        With the 'partial' eigensolver, only the steady state and the `self.modes` slowest modes
+        are computed, and `self.eigenvalues` holds just those.
         """
 
-        self.eigenvalues, eigenvectors = np.linalg.eig(np.transpose(self.tm))
-        ss = abs(eigenvectors[:, self.eigenvalues.argmax()].astype(float))
+        vector = None
+        if self.eigensolver == 'partial':
+            from spectrum import slowest_modes
+            try:
+                rates, eigenvectors = slowest_modes(self.generator(), self.modes)
+                self.eigenvalues = 1 + self.dt * rates.real
+                vector = eigenvectors[:, 0]
+                # The sparse eigenvectors carry an arbitrary complex phase.
+                ss = abs(vector)
+            except (ArpackError, ArpackNoConvergence, RuntimeError):
+                self.fallbacks.append('partial eigensolver -> dense')
+        if vector is None:
+            self.eigenvalues, eigenvectors = np.linalg.eig(np.transpose(self.tm))
+            vector = eigenvectors[:, self.eigenvalues.argmax()]
+            ss = abs(vector.astype(float))
+        self.inspect_eigenvector(vector)
         self.ss = ss / np.sum(ss)
+        self.calculate_relaxation()
+        return
+
+    def inspect_eigenvector(self, vector):
+        """
+        The steady-state eigenvector should be real and of one sign, up to a constant phase.
+        After rotating the largest element onto the positive real axis, this function records
+        the largest imaginary part and the mass of the negative elements, both relative to the
+        size of the vector; `abs()` hides either.
+        """
+        vector = vector * np.exp(-1j * np.angle(vector[np.argmax(np.abs(vector))]))
+        self.imaginary_part = np.max(np.abs(vector.imag)) / np.max(np.abs(vector))
+        real = vector.real
+        self.negative_mass = np.sum(np.maximum(-real, 0)) / np.sum(np.abs(real))
+        return
+
+    def generator(self):
+        """
+        This function returns the rate matrix behind the transition matrix as a sparse matrix.
+        The scaling of the off-diagonal rates is undone and the diagonal is rebuilt from them,
+        rather than from 1 - dt * (row sum), which loses precision. With the 'generator' pipeline
+        the rate matrix is returned as it was built.
+        """
+        if self.pipeline == 'generator':
+            return self.rate_generator
+        generator = sparse.csr_matrix(self.tm / self.dt)
+        generator.setdiag(0)
+        generator.eliminate_zeros()
+        return generator - sparse.diags(np.asarray(generator.sum(axis=1)).ravel())
+
+    def solver_settings(self):
+        """
+        Return the settings of `batch.PROFILES` for a direct solve. The 'legacy' profile solves
+        like 'exact' where there is no transition matrix to diagonalize.
+        """
+        return PROFILES['exact' if self.profile == 'legacy' else self.profile]
+
+    def calculate_steady_state(self):
+        """
+        The steady-state population is computed directly, by solving p K = 0 with sum(p) = 1 with a
+        sparse LU factorization of the rate matrix, in the precision and with the number of
+        refinement steps set by `self.profile`. No eigenvalues are computed.
+        """
+        settings = self.solver_settings()
+        generator = self.generator()
+        scale = np.abs(generator.diagonal()).max()
+        dtype = settings['dtype']
+        if dtype != np.float64 and np.finfo(dtype).eps * scale > settings['tolerance']:
+            # Too stiff for single precision.
+            self.fallbacks.append('float32 -> float64')
+            dtype = np.float64
+        # Replace the last balance equation by the normalization condition.
+        system = (generator.T / scale).tolil()
+        system[-1, :] = 1.0
+        system = system.tocsc()
+        rhs = np.zeros(2 * self.bins)
+        rhs[-1] = 1.0
+        try:
+            lu = splu(system.astype(dtype))
+        except RuntimeError:
+            # The factorization found a singular matrix.
+            self.fallbacks.append('sparse LU -> dense eigenvectors')
+            if self.pipeline == 'generator':
+                # The null vector of the rate matrix itself; there is no transition matrix.
+                rates, eigenvectors = np.linalg.eig(generator.T.toarray())
+                vector = eigenvectors[:, rates.real.argmax()]
+                self.inspect_eigenvector(vector)
+                self.ss = abs(vector.real) / np.sum(abs(vector.real))
+            else:
+                self.calculate_eigenvector()
+            return
+        ss = lu.solve(rhs.astype(dtype)).astype(float)
+        for _ in range(settings['refine']):
+            ss += lu.solve((rhs - system.dot(ss)).astype(dtype))
+        self.ss = ss
+        self.imaginary_part = 0.0
+        self.negative_mass = np.sum(np.maximum(-ss, 0)) / np.sum(np.abs(ss))
+        return
+
+    def diagnostics(self):
+        """
+        This function returns the numerical health of the last solve as a dictionary.
+        """
+        return {'dt': self.dt,
+                'stiffness': self.stiffness,
+                'residual': self.residual,
+                'normalization_error': self.normalization_error,
+                'imaginary_part': self.imaginary_part,
+                'negative_mass': self.negative_mass,
+                'overflow': self.overflow,
+                'fallbacks': list(self.fallbacks)}
+
+    def observables(self):
+        """
+        This function returns every standard summary of the last solve (fluxes, velocity and
+        populations) as one record, see `observables.extract`.
+        """
+        return extract(self.ss, self.flux_u, self.flux_b, self.flux_ub, self.catalytic_rate)[0]
+
+    def calculate_accuracy(self):
+        """
+        This function measures how well the steady-state population solves the balance equations:
+        the residual max|p K| (per second, so it bounds the error of every flux) and the
+        normalization error |sum(p) - 1|. The solve is flagged for an exact rerun if either is
+        above the tolerance of `self.profile`. The eigenvector solve of the 'legacy' profile is not
+        flagged: it reproduces the published results, whatever its residual.
+        """
+        self.residual = np.abs(self.generator().T.dot(self.ss)).max()
+        self.normalization_error = abs(np.sum(self.ss) - 1)
+        if self.profile == 'legacy' and self.pipeline != 'generator':
+            self.flagged = None
+            return
+        tolerance = self.solver_settings()['tolerance']
+        self.flagged = bool(self.residual > tolerance or self.normalization_error > tolerance)
+        return
+
+    def calculate_relaxation(self):
+        """
+        The relaxation times of the `self.modes` slowest modes follow from the eigenvalues of the
+        transition matrix, mu = 1 + dt * lambda, where lambda are the eigenvalues of the rate
+        matrix.
+        """
+        rates = -np.real(self.eigenvalues - 1) / self.dt
+        rates = np.sort(rates)[1:self.modes + 1]
+        self.relaxation_times = 1. / rates
+        self.spectral_gap = rates[0]
+        return
+
+    def calculate_modes(self):
+        """
+        With the 'partial' eigensolver, the `self.modes` slowest modes of a direct solve, which
+        computes no eigenvalues, are found from the sparse rate matrix. In the 'generator' pipeline
+        there is no transition matrix, so `self.eigenvalues` stays None.
+        """
+        from spectrum import relaxation_times, slowest_modes
+        try:
+            rates = slowest_modes(self.generator(), self.modes)[0]
+        except (ArpackError, ArpackNoConvergence, RuntimeError):
+            self.fallbacks.append('partial eigensolver -> dense')
+            rates = np.linalg.eigvals(self.generator().toarray())
+            rates = rates[np.argsort(-rates.real)][:self.modes + 1]
+        if self.pipeline == 'generator':
+            self.relaxation_times = relaxation_times(rates)
+            self.spectral_gap = 1. / self.relaxation_times[0]
+        else:
+            self.eigenvalues = 1 + self.dt * rates.real
+            self.calculate_relaxation()
+        return
+
+    def calculate_edge_flux(self):
+        """
+        The fluxes of the 'generator' pipeline, straight from the edge list: the net flux across
+        every edge is p_i k_ij - p_j k_ji, with the same signs as `calculate_flux`.
+        """
+        flux_u, flux_b, flux_ub = calculate_fluxes(np.atleast_2d(self.ss), self.rates)
+        self.flux_u = flux_u[0]
+        self.flux_b = flux_b[0]
+        self.flux_ub = flux_ub[0]
         return
 
     def calculate_flux(self, ss, tm):
@@ -286,105 +544,93 @@ class Simulation(object):
 
 
 
-    def simulate(self, plot=False, user_energies=False, catalysis=True):
+    def population_files(self):
         """
-        Now this function takes in a file(name) and determins the energy surfaces automatically,
-        so I don't forget to do it in an interactive session.
-        This function runs the `simulation` which involves:
-        (a) setting the unbound intrasurface rates,
-        (b) setting the bound intrasurface rates,
-        (c) setting the intersurface rates,
-        (d) composing the transition matrix,
-        (e) calculating the eigenvectors of the transition matrix,
-        (f) calculating the intrasurface flux,
-        and optionally (g) running an interative method to determine the steady-state distribution.
+        This function returns the paths of the unbound and bound population histograms of
+        `self.name` together with the `np.genfromtxt` keywords needed to parse them.
+        It returns `None` for data sources that do not read populations from disk.
         """
-        if self.data_source == 'pka_md_data':
-            self.dir = './md-data/pka-md-data'
-            try:
-                self.unbound_population = np.genfromtxt(self.dir + '/apo/' + self.name +
-                                                        '_chi_pop_hist_targ.txt',
-                                                        delimiter=',',
-                                                        skip_header=1)
-                self.bound_population = np.genfromtxt(self.dir + '/atpmg/' + self.name +
-                                                      '_chi_pop_hist_ref.txt',
-                                                      delimiter=',',
-                                                      skip_header=1)
-            except IOError:
-                print('Cannot read {} from {}.'.format(self.name, self.dir))
-            cmap = sns.color_palette("Paired", 10)
-            self.unbound_clr = cmap[6]
-            self.bound_clr = cmap[7]
-
-        elif self.data_source == 'pka_reversed':
-            self.dir = './md-data/pka-md-reversed-and-averaged'
-            try:
-                self.unbound_population = np.genfromtxt(self.dir + '/apo/' + self.name +
-                                                        '_chi_pop_hist_targ.txt',
-                                                        delimiter=',',
-                                                        skip_header=1)
-                self.bound_population = np.genfromtxt(self.dir + '/atpmg/' + self.name +
-                                                      '_chi_pop_hist_ref.txt',
-                                                      delimiter=',',
-                                                      skip_header=1)
-
-            except IOError:
-                print('Cannot read {} from {}.'.format(self.name, self.dir))
+        if self.data_source == 'pka_md_data' or self.data_source == 'pka_reversed':
+            if self.data_source == 'pka_md_data':
+                self.dir = './md-data/pka-md-data'
+            else:
+                self.dir = './md-data/pka-md-reversed-and-averaged'
+            return (self.dir + '/apo/' + self.name + '_chi_pop_hist_targ.txt',
+                    self.dir + '/atpmg/' + self.name + '_chi_pop_hist_ref.txt',
+                    dict(delimiter=',', skip_header=1))
+        elif self.data_source == 'adk_md_data':
+            self.dir = './md-data/adenylate-kinase'
+            return (self.dir + '/AdKDihedHist_apo-4ake/' + self.name + '.dat',
+                    self.dir + '/AdKDihedHist_ap5-3hpq/' + self.name + '.dat',
+                    dict(delimiter=' ', skip_header=1, usecols=1))
+        elif self.data_source == 'hiv_md_data':
+            self.dir = './md-data/hiv-protease'
+            return (self.dir + '/1hhp_apo/' + self.name + '.dat',
+                    self.dir + '/1kjf_p1p6/' + self.name + '.dat',
+                    dict(delimiter=' ', skip_header=1, usecols=1))
+        return None
 
-            cmap = sns.color_palette("Paired", 10)
+    def set_colors(self):
+        """
+        This function assigns the unbound and bound plotting colours for the data source.
+        """
+        cmap = sns.color_palette("Paired", 10)
+        if self.data_source == 'pka_md_data' or self.data_source == 'pka_reversed':
             self.unbound_clr = cmap[6]
             self.bound_clr = cmap[7]
-
         elif self.data_source == 'adk_md_data':
-            self.dir = './md-data/adenylate-kinase'
-            try:
-                self.unbound_population = np.genfromtxt(self.dir + '/AdKDihedHist_apo-4ake/' +
-                                                        self.name + '.dat',
-                                                        delimiter=' ',
-                                                        skip_header=1,
-                                                        usecols=1)
-                self.bound_population = np.genfromtxt(self.dir + '/AdKDihedHist_ap5-3hpq/' +
-                                                      self.name + '.dat',
-                                                      delimiter=' ',
-                                                      skip_header=1,
-                                                      usecols=1)
-
-            except IOError:
-                print('Cannot read {} from {}.'.format(self.name, self.dir))
-
-            cmap = sns.color_palette("Paired", 10)
             # self.unbound_clr = cmap[0]
             self.unbound_clr = cmap[3]
             self.bound_clr = cmap[1]
-
         elif self.data_source == 'hiv_md_data':
-            self.dir = './md-data/hiv-protease'
-            try:
-                self.unbound_population = np.genfromtxt(self.dir + '/1hhp_apo/' +
-                                                        self.name + '.dat',
-                                                        delimiter=' ',
-                                                        skip_header=1,
-                                                        usecols=1)
-                self.bound_population = np.genfromtxt(self.dir + '/1kjf_p1p6/' +
-                                                      self.name + '.dat',
-                                                      delimiter=' ',
-                                                      skip_header=1,
-                                                      usecols=1)
-
-            except IOError:
-                print('Cannot read {} from {}.'.format(self.name, self.dir))
-
-            cmap = sns.color_palette("Paired", 10)
             self.unbound_clr = cmap[2]
             self.bound_clr = cmap[3]
-
-        elif self.data_source == 'manual':
-            # Populations are supplied manually.
-            cmap = sns.color_palette("Paired", 10)
+        else:
             self.unbound_clr = cmap[8]
             self.bound_clr = cmap[9]
-        else:
+
+    def read_populations(self):
+        """
+        This function reads the unbound and bound population histograms of `self.name` from disk.
+        For the `manual` data source, the populations are expected to be supplied by the user.
+        If a histogram bank is attached, the populations are views of its rows instead.
+        """
+        if self.bank is not None:
+            self.unbound_population, self.bound_population = self.bank.populations(self.name)
+            return
+        files = self.population_files()
+        if files is not None:
+            unbound_file, bound_file, options = files
+            try:
+                self.unbound_population = np.genfromtxt(unbound_file, **options)
+                self.bound_population = np.genfromtxt(bound_file, **options)
+            except IOError:
+                print('Cannot read {} from {}.'.format(self.name, self.dir))
+        elif self.data_source != 'manual':
             print('No populations.')
+        return
+
+    def simulate(self, plot=False, user_energies=False, catalysis=True,
+                 user_populations=False):
+        """
+        Now this function takes in a file(name) and determins the energy surfaces automatically,
+        so I don't forget to do it in an interactive session.
+        This function runs the `simulation` which involves:
+        (a) setting the unbound intrasurface rates,
+        (b) setting the bound intrasurface rates,
+        (c) setting the intersurface rates,
+        (d) composing the transition matrix,
+        (e) calculating the eigenvectors of the transition matrix (or, with the 'exact', 'fast' and
+        'screen' profiles, solving for the steady state directly) and the accuracy of the steady
+        state,
+        (f) calculating the intrasurface flux,
+        With the 'generator' pipeline, (d) to (f) work on the sparse rate matrix instead, see
+        `compose_generator`.
+        and optionally (g) running an interative method to determine the steady-state distribution.
+        """
+        if not user_populations:
+            self.read_populations()
+        self.set_colors()
         if user_energies:
             pass
         else:
@@ -396,6 +642,84 @@ class Simulation(object):
         self.tm = np.zeros((self.bins, self.bins))
         self.C_intrasurface = self.D / (360. / self.bins) ** 2  # per degree per second
 
+        # Forget the spectrum and the diagnostics of the previous solve.
+        self.eigenvalues = self.relaxation_times = self.spectral_gap = None
+        self.residual = self.normalization_error = self.flagged = None
+        self.stiffness = self.imaginary_part = self.negative_mass = self.overflow = None
+        self.fallbacks = []
+        key = None
+        if self.cache is not None:
+            # The solver settings change the result too, and `modes` the stored relaxation times.
+            settings = dict(self.parameters(), eigensolver=self.eigensolver, profile=self.profile,
+                            modes=self.modes)
+            if self.profile != 'legacy':
+                # Entries stored while 'exact' meant the eigenvector solve must not be reused.
+                settings['refine'] = self.solver_settings()['refine']
+            if self.pipeline != 'transition':
+                settings['pipeline'] = self.pipeline
+            if user_energies:
+                key = self.cache.key(self.unbound, self.bound, settings)
+            else:
+                key = self.cache.key(self.unbound_population, self.bound_population, settings)
+            stored = self.cache.get(key)
+            if stored is not None and self.eigensolver == 'partial' and \
+                    'relaxation_times' not in stored:
+                # Stored without the slowest modes; solve again.
+                stored = None
+            if stored is not None:
+                self.dt = float(stored['dt'])
+                self.ss = stored['ss']
+                self.flux_u = stored['flux_u']
+                self.flux_b = stored['flux_b']
+                self.flux_ub = stored['flux_ub']
+                for name in ('residual', 'normalization_error', 'stiffness', 'imaginary_part',
+                             'negative_mass'):
+                    if name in stored:
+                        setattr(self, name, float(stored[name]))
+                if 'flagged' in stored and not np.isnan(stored['flagged']):
+                    self.flagged = bool(stored['flagged'])
+                if 'overflow' in stored:
+                    self.overflow = bool(stored['overflow'])
+                    self.fallbacks = [str(fallback) for fallback in stored['fallbacks']]
+                if 'relaxation_times' in stored and len(stored['relaxation_times']):
+                    self.relaxation_times = stored['relaxation_times']
+                    self.spectral_gap = 1. / self.relaxation_times[0]
+                self.calculate_boltzmann()
+                if plot:
+                    self.plot_all()
+                return
+
+        if self.pipeline == 'generator':
+            self.compose_generator()
+            self.calculate_steady_state()
+            if self.eigensolver == 'partial':
+                self.calculate_modes()
+            self.calculate_accuracy()
+            self.calculate_boltzmann()
+            self.calculate_edge_flux()
+        else:
+            self.simulate_transition_matrix()
+        if key is not None:
+            self.cache.put(key, dt=self.dt, ss=self.ss, flux_u=self.flux_u,
+                           flux_b=self.flux_b, flux_ub=self.flux_ub, residual=self.residual,
+                           normalization_error=self.normalization_error,
+                           flagged=np.nan if self.flagged is None else self.flagged,
+                           stiffness=self.stiffness, imaginary_part=self.imaginary_part,
+                           negative_mass=self.negative_mass, overflow=self.overflow,
+                           fallbacks=np.array(self.fallbacks, dtype=str),
+                           relaxation_times=np.array(self.relaxation_times if
+                                                     self.relaxation_times is not None else [],
+                                                     dtype=float))
+        if plot:
+            self.plot_all()
+        return
+
+    def simulate_transition_matrix(self):
+        """
+        The original pipeline: the rate matrices are scaled by `dt` into a transition matrix, the
+        steady state is found from it as set by `self.profile` and `self.eigensolver`, and the
+        fluxes are scaled back by `dt`.
+        """
         if not self.load:
             u_rm = self.calculate_intrasurface_rates(self.unbound)
             b_rm = self.calculate_intrasurface_rates(self.bound)
@@ -406,19 +730,29 @@ class Simulation(object):
         ub_rm, bu_rm = self.calculate_intersurface_rates(
             self.unbound, self.bound)
         self.compose_tm(u_rm, b_rm, ub_rm, bu_rm)
-        self.calculate_eigenvector()
+        if self.profile == 'legacy':
+            self.calculate_eigenvector()
+        else:
+            self.calculate_steady_state()
+            if self.eigensolver == 'partial' and self.relaxation_times is None:
+                self.calculate_modes()
+        self.calculate_accuracy()
         self.calculate_boltzmann()
         self.calculate_flux(self.ss, self.tm)
-        if plot:
-            self.plot_input()
-            if not self.load:
-                self.plot_energy()
-            else:
-                self.plot_load()
-            self.plot_ss()
-            self.plot_flux()
-            self.plot_intersurface_flux()
         return
 
+    def plot_all(self):
+        """
+        This function draws the input, energy (or load), steady-state and flux plots.
+        """
+        self.plot_input()
+        if not self.load:
+            self.plot_energy()
+        else:
+            self.plot_load()
+        self.plot_ss()
+        self.plot_flux()
+        self.plot_intersurface_flux()
+
     def load_function(self, x):
         return x * self.load_slope / self.bins
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+These functions compute only the slowest relaxation modes of the rate matrix, with a sparse
+shift-invert eigensolver, instead of the full dense spectrum. The slowest mode is the steady state
+(eigenvalue zero); the next ones give the relaxation times of the torsion, and the first of those
+the spectral gap.
+"""
+
+import numpy as np
+import scipy.sparse as sparse
+from scipy.sparse.linalg import eigs
+
+from batch import calculate_rates, histograms_to_energies
+from scan import configure, read_histograms
+from simulation import Simulation
+
+
+def sparse_generator(rates, row=0):
+    """
+    Build one rate matrix of a batch as a sparse matrix, with the same layout as
+    `batch.compose_generators` (off-diagonal rates, minus the row sum on the diagonal).
+    :param rates: a dictionary returned by `batch.calculate_rates`
+    :param row: which row of the batch to use
+    :return: a (2 * bins x 2 * bins) CSR matrix
+    """
+    bins = rates['forward_u'].shape[1]
+    index = np.arange(bins)
+    following = np.roll(index, -1)
+    rows = np.concatenate((index, following, index + bins, following + bins, index, index + bins))
+    columns = np.concatenate((following, index, following + bins, index + bins, index + bins,
+                              index))
+    values = np.concatenate([rates[key][row] for key in ('forward_u', 'backward_u', 'forward_b',
+                                                          'backward_b', 'ub', 'bu')])
+    generator = sparse.csr_matrix((values, (rows, columns)), shape=(2 * bins, 2 * bins))
+    return generator - sparse.diags(np.asarray(generator.sum(axis=1)).ravel())
+
+
+def slowest_modes(generator, k=5):
+    """
+    Find the k + 1 slowest modes of a rate matrix K, i.e., the eigenvalues of K with the largest
+    real parts (all of them are <= 0) and their left eigenvectors, p K = lambda p.
+    The eigenvalues closest to a small positive shift are found by ARPACK in shift-invert mode;
+    the shift keeps K - sigma I non-singular without changing which modes are the slowest.
+    :param generator: a sparse or dense rate matrix
+    :param k: the number of relaxation modes besides the steady state
+    :return: the eigenvalues, sorted from the steady state (about zero) to faster modes, and the
+    eigenvectors as columns
+    """
+    generator = sparse.csc_matrix(generator)
+    m = generator.shape[0]
+    if k + 1 >= m - 1:
+        # ARPACK needs k < m - 1; a small matrix is cheap to diagonalize anyway.
+        eigenvalues, eigenvectors = np.linalg.eig(generator.T.toarray())
+    else:
+        sigma = 1e-9 * np.abs(generator.diagonal()).max()
+        eigenvalues, eigenvectors = eigs(generator.T.tocsc(), k=k + 1, sigma=sigma, which='LM')
+    order = np.argsort(-eigenvalues.real)[:k + 1]
+    return eigenvalues[order], eigenvectors[:, order]
+
+
+def relaxation_times(eigenvalues):
+    """
+    Turn the eigenvalues returned by `slowest_modes` into relaxation times (s), dropping the
+    steady state.
+    """
+    return -1. / np.real(eigenvalues[1:])
+
+
+def relaxation_spectrum(data_source, names, k=5, parameters=None, bank=None):
+    """
+    Compute the k slowest relaxation times and the spectral gap of each torsion of a protein.
+    :param data_source: one of the recognized protein systems in the class
+    :param names: a list of torsion filenames
+    :param k: the number of relaxation modes per torsion
+    :param parameters: a dictionary of `Simulation` attributes to override
+    :param bank: an optional `HistogramBank` to take the populations from
+    :return: a dataframe with columns 'File', 'Spectral gap' (per second) and
+    'Relaxation time 1' to 'Relaxation time k' (s), slowest first
+    """
+    import pandas as pd
+    this = Simulation(data_source=data_source)
+    configure(this, parameters or {})
+    unbound, bound = read_histograms(data_source, names, bank=bank)
+    unbound = histograms_to_energies(unbound, this.kT, this.periodic_smoothing)
+    bound = histograms_to_energies(bound, this.kT, this.periodic_smoothing) - this.offset_factor
+    rates = calculate_rates(unbound, bound, this.parameters())
+    times = np.array([relaxation_times(slowest_modes(sparse_generator(rates, row), k)[0])
+                      for row in range(len(names))])
+    frame = pd.DataFrame({'File': names, 'Spectral gap': 1. / times[:, 0]})
+    for mode in range(times.shape[1]):
+        frame['Relaxation time {}'.format(mode + 1)] = times[:, mode]
+    return frame
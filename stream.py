@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+These functions run a sweep on a pool of worker processes and yield each `SimulationResult` as
+soon as it is finished, instead of blocking until the whole loop is done. Only `max_in_flight`
+points are submitted at a time, so stopping early (e.g. with `break`) loses nothing that has
+already been yielded and leaves little work behind. Unless told otherwise, the number of workers and
+of BLAS threads per worker come from `scheduler.plan`, so the pool does not oversubscribe the node.
+
+For example, to update a plot while a concentration scan runs:
+
+    grid = [{'cSubstrate': 10 ** c} for c in np.arange(-6, 0, 0.1)]
+    for result in iterate('adk_md_data', names, grid, workers=8):
+        ...
+"""
+
+import asyncio
+import itertools
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from scan import run
+from scheduler import Throughput, available_cores, plan, start_pool
+
+
+def _tasks(names, grid):
+    return itertools.product(names, grid)
+
+
+def _schedule(names, grid, bank=None, workers=None, threads=None):
+    """
+    Fill in the workers and threads of a sweep that are not given, see `scheduler.plan`.
+    """
+    if workers is None:
+        bins = bank.bins if bank is not None else 60
+        schedule = plan(bins, tasks=len(names) * len(grid))
+        workers = schedule['workers']
+        threads = threads or schedule['threads']
+    return workers, threads
+
+
+def completed(function, tasks, workers=None, max_in_flight=None, threads=None, throughput=None):
+    """
+    Call `function(*task)` for every task on a pool of worker processes and yield
+    `(task, result)` in order of completion, with at most `max_in_flight` tasks submitted at once.
+    :param function: a function that can be pickled, i.e., defined at the top level of a module
+    :param tasks: an iterable of argument tuples
+    :param workers: the number of worker processes; 0 runs every task in this process, in order;
+    one per core by default
+    :param max_in_flight: the largest number of submitted but unfinished tasks; defaults to
+    twice the number of workers
+    :param threads: the number of BLAS threads per worker; by default the cores are shared evenly
+    between the workers
+    :param throughput: an optional `scheduler.Throughput` that counts the finished tasks
+    """
+    tasks = iter(tasks)
+    if workers == 0:
+        for task in tasks:
+            result = function(*task)
+            if throughput is not None:
+                throughput.add()
+            yield task, result
+        return
+    workers = workers or plan()['workers']
+    threads = threads or max(1, available_cores() // workers)
+    max_in_flight = max_in_flight or 2 * workers
+    pending = {}
+    executor = start_pool(workers, threads)
+    try:
+        while True:
+            for task in itertools.islice(tasks, max_in_flight - len(pending)):
+                pending[executor.submit(function, *task)] = task
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = pending.pop(future)
+                result = future.result()
+                if throughput is not None:
+                    throughput.add()
+                yield task, result
+    finally:
+        # Reached on completion, on an error, and when the caller stops iterating early.
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def iterate(data_source, names, grid, workers=None, max_in_flight=None, cache=None, bank=None,
+            threads=None, verbose=False):
+    """
+    Yield a `SimulationResult` for every torsion at every grid point, in order of completion.
+    :param data_source: one of the recognized protein systems in the class
+    :param names: a list of torsion filenames
+    :param grid: a list of dictionaries of `Simulation` attributes, one per grid point
+    :param workers: the number of worker processes; 0 runs every point in this process, in order;
+    chosen by `scheduler.plan` by default
+    :param max_in_flight: the largest number of submitted but unfinished points; defaults to
+    twice the number of workers
+    :param cache: an optional `ResultCache`
+    :param bank: an optional `HistogramBank`; workers attach to it instead of reading `md-data`
+    :param threads: the number of BLAS threads per worker, see `completed`
+    :param verbose: print the throughput when the sweep is done or stopped
+    """
+    workers, threads = _schedule(names, grid, bank, workers, threads)
+    tasks = ((data_source, name, parameters, cache, bank)
+             for name, parameters in _tasks(names, grid))
+    throughput = Throughput(workers or 1, threads or 1)
+    try:
+        for _, result in completed(run, tasks, workers, max_in_flight, threads, throughput):
+            yield result
+    finally:
+        if verbose:
+            print(throughput)
+
+
+async def aiterate(data_source, names, grid, workers=None, max_in_flight=None, cache=None,
+                   bank=None, threads=None):
+    """
+    The `asyncio` counterpart of `iterate`:
+
+        async for result in aiterate('adk_md_data', names, grid, workers=8):
+            ...
+
+    With `workers=0`, every point runs in this process, in order, as in `iterate`.
+    """
+    if workers == 0:
+        for name, parameters in _tasks(names, grid):
+            yield run(data_source, name, parameters, cache, bank)
+            # Let other tasks of the event loop run between the points.
+            await asyncio.sleep(0)
+        return
+    loop = asyncio.get_running_loop()
+    workers, threads = _schedule(names, grid, bank, workers, threads)
+    threads = threads or max(1, available_cores() // workers)
+    max_in_flight = max_in_flight or 2 * workers
+    tasks = _tasks(names, grid)
+    pending = set()
+    executor = start_pool(workers, threads)
+    try:
+        while True:
+            for name, parameters in itertools.islice(tasks, max_in_flight - len(pending)):
+                pending.add(loop.run_in_executor(executor, run, data_source, name, parameters,
+                                                 cache, bank))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
@@ -22,16 +22,8 @@ def summarize_fluxes(name, concentration, data_source='adk_md_data', catalytic_r
         this.catalytic_rate = catalytic_rate
     this.name = name
     this.simulate()
-    directional_flux = np.mean(this.flux_u + this.flux_b)
-    intersurface_flux = max(abs(this.flux_ub))
-    # Make all flux on each surface positive
-    unbound_flux = abs(this.flux_u)
-    bound_flux = abs(this.flux_b)
-    # Now find the maximum on either surface
-    max_unbound = max(unbound_flux)
-    max_bound = max(bound_flux)
-    driven_flux = max([max_unbound, max_bound])
-    return directional_flux, intersurface_flux, driven_flux
+    record = this.observables()
+    return record['directional_flux'], record['intersurface_flux'], record['driven_flux']
 
 
 def summarize_power_and_load(name, concentration, data_source='adk_md_data', negative=False,
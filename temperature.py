@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+These functions calculate fluxes as a function of temperature. The smoothed log-populations of
+every torsion do not depend on `kT`, so they are computed once; each temperature then only
+rescales the energy surfaces, E = -kT log p (minus the offset for the bound surface), and the rates
+that follow from them, for all torsions and temperatures in one batch.
+
+    scan = temperature_scan('adk_md_data', names, np.linspace(0.5, 0.7, 21))
+    frame = scan.to_frame()
+"""
+
+import numpy as np
+
+from bank import discover_names
+from batch import histograms_to_log_populations, simulate_batch
+from results import DIAGNOSTICS, PARAMETERS, ScanResult
+from scan import configure, read_histograms
+from simulation import Simulation
+
+
+def temperature_scan(data_source, names=None, kTs=(0.6,), parameters=None, bank=None,
+                     profile='fast'):
+    """
+    Simulate every torsion at every temperature.
+    :param data_source: one of the recognized protein systems in the class
+    :param names: a list of torsion filenames; every torsion of the data source by default
+    :param kTs: the temperatures, in kcal per mol
+    :param parameters: a dictionary of other `Simulation` attributes to override
+    :param bank: an optional `HistogramBank` to take the populations from
+    :param profile: the solver profile, one of `batch.PROFILES`
+    :return: a `ScanResult` with `len(names) * len(kTs)` rows, ordered by torsion then temperature;
+    `dt` is NaN, since no transition matrix is scaled
+    """
+    if names is None:
+        names = discover_names(data_source)
+    this = Simulation(data_source=data_source)
+    configure(this, parameters or {})
+    unbound, bound = read_histograms(data_source, names, bank=bank)
+    log_unbound = histograms_to_log_populations(unbound, this.periodic_smoothing)
+    log_bound = histograms_to_log_populations(bound, this.periodic_smoothing)
+    kTs = np.asarray(kTs, dtype=float)
+    n, k = len(names), len(kTs)
+    kT = np.tile(kTs, n)
+    # One row per torsion and temperature.
+    unbound = -kT[:, None] * np.repeat(log_unbound, k, axis=0)
+    bound = -kT[:, None] * np.repeat(log_bound, k, axis=0) - this.offset_factor
+    model = dict(this.parameters(), kT=kT)
+    fluxes = simulate_batch(unbound, bound, model, user_energies=True, profile=profile)
+    stored = np.empty(n * k, dtype=ScanResult.parameter_dtype())
+    for key in PARAMETERS:
+        value = model[key]
+        stored[key] = np.nan if value is None else value
+    diagnostics = np.full(n * k, np.nan, dtype=ScanResult.diagnostic_dtype())
+    for key in DIAGNOSTICS:
+        if key in fluxes:
+            diagnostics[key] = fluxes[key]
+    # A direct solve has no eigenvector to be complex.
+    diagnostics['imaginary_part'] = 0.0
+    return ScanResult(data_source, np.repeat(np.asarray(names), k), stored, np.full(n * k, np.nan),
+                      fluxes['ss'], fluxes['flux_u'], fluxes['flux_b'], fluxes['flux_ub'],
+                      fluxes['residual'], fluxes['normalization_error'], diagnostics)
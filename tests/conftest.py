@@ -0,0 +1,33 @@
+"""
+Shared fixtures: the tests run on a few synthetic torsions written to a temporary `md-data`, so
+they do not need the simulation data of the manuscript.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+
+@pytest.fixture
+def adk_names(tmp_path, monkeypatch):
+    """
+    Write three adenylate kinase torsions with random histograms and change to their directory.
+    :return: the names of the torsions
+    """
+    rng = np.random.default_rng(0)
+    angles = np.arange(-180., 180., 6.)
+    names = ['chi1THR{}'.format(i) for i in range(1, 4)]
+    for folder in ('AdKDihedHist_apo-4ake', 'AdKDihedHist_ap5-3hpq'):
+        directory = tmp_path / 'md-data' / 'adenylate-kinase' / folder
+        directory.mkdir(parents=True)
+        for name in names:
+            counts = 1 + rng.integers(0, 1000, size=len(angles))
+            np.savetxt(str(directory / (name + '.dat')), np.column_stack([angles, counts]),
+                       fmt='%.1f %d', header='angle pop')
+    monkeypatch.chdir(tmp_path)
+    return names
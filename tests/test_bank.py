@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+
+from bank import HistogramBank, read_populations
+
+
+def test_load_matches_files(adk_names):
+    unbound, bound = read_populations('adk_md_data', adk_names)
+    with HistogramBank.load('adk_md_data', adk_names) as bank:
+        for name, row in zip(adk_names, unbound):
+            assert np.array_equal(bank.populations(name)[0], row)
+        assert not bank.populations(adk_names[0])[0].flags.writeable
+
+
+def test_load_missing_torsion(adk_names):
+    with pytest.raises(IOError):
+        HistogramBank.load('adk_md_data', adk_names + ['chi1THR999'])
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import scan as module
+from batch import simulate_batch
+from scan import adaptive_concentration_scan, read_histograms, run, scan
+
+
+def test_read_histograms_missing_torsion(adk_names):
+    with pytest.raises(IOError):
+        read_histograms('adk_md_data', [adk_names[0], 'chi1THR999'])
+
+
+def test_scan_points_start_from_defaults(adk_names):
+    grid = [{'catalytic_rate': 10, 'cSubstrate': 1e-3, 'periodic_smoothing': True,
+             'load_slope': 1.0},
+            {'cSubstrate': 1e-3}]
+    result = scan('adk_md_data', adk_names[:1], grid)
+    for row, parameters in enumerate(grid):
+        expected = run('adk_md_data', adk_names[0], parameters)
+        assert result.parameters[row]['catalytic_rate'] == expected.parameters['catalytic_rate']
+        assert result.parameters[row]['periodic_smoothing'] == \
+            expected.parameters['periodic_smoothing']
+        assert np.array_equal(result.flux_u[row], expected.flux_u)
+    assert result.parameters['catalytic_rate'][1] == 312
+
+
+def _count_solves(monkeypatch):
+    solves = []
+
+    def counting(unbound, *args, **kwargs):
+        solves.append(len(unbound))
+        return simulate_batch(unbound, *args, **kwargs)
+
+    monkeypatch.setattr(module, 'simulate_batch', counting)
+    return solves
+
+
+def test_adaptive_scan_beats_uniform_grid(adk_names, monkeypatch):
+    uniform = adaptive_concentration_scan('adk_md_data', adk_names[0], initial_points=100,
+                                          max_points=100)
+    solves = _count_solves(monkeypatch)
+    adaptive = adaptive_concentration_scan('adk_md_data', adk_names[0])
+    assert sum(solves) == len(adaptive[0]) <= 100 // 3
+    for exact, values in zip(uniform[1:], adaptive[1:]):
+        interpolated = np.interp(np.log10(uniform[0]), np.log10(adaptive[0]), values)
+        assert np.max(np.abs(interpolated - exact)) <= 0.01 * np.ptp(exact) + 1e-2
+
+
+def test_adaptive_scan_ignores_noise(adk_names, monkeypatch):
+    # Identical flat surfaces: the directional flux is zero up to rounding.
+    for folder in ('AdKDihedHist_apo-4ake', 'AdKDihedHist_ap5-3hpq'):
+        angles = np.arange(-180., 180., 6.)
+        np.savetxt('md-data/adenylate-kinase/{}/flat.dat'.format(folder),
+                   np.column_stack([angles, np.full(len(angles), 100)]), fmt='%.1f %d',
+                   header='angle pop')
+    solves = _count_solves(monkeypatch)
+    concentrations, directional = adaptive_concentration_scan('adk_md_data', 'flat')[:2]
+    assert np.ptp(directional) < 1e-2
+    assert sum(solves) <= 100 // 3
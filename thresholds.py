@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+These functions find, for each torsion and flux threshold, the concentrations at which the
+magnitude of the flux crosses the threshold. The number of torsions above a threshold at any
+concentration then follows from a sorted list of crossings, instead of dense scans of every torsion
+followed by `find_above_threshold`.
+"""
+
+import numpy as np
+
+from batch import flux_observables, histograms_to_energies, simulate_batch
+from scan import configure, read_histograms
+from simulation import Simulation
+
+
+def find_threshold_crossings(data_source, names, thresholds, quantity='Directional flux',
+                             log_min=-6, log_max=0, coarse_points=25, xtol=1e-3,
+                             catalytic_rate=None, parameters=None):
+    """
+    Locate every concentration where |quantity| crosses each threshold.
+    All torsions are first solved on a coarse grid in log10(concentration). Every interval of the
+    grid across which |quantity| passes a threshold is then narrowed by bisection, with all the
+    intervals of all torsions solved together in one batch per step. Crossings that come and go
+    within a single coarse interval are not seen, so `coarse_points` should resolve the narrowest
+    feature of interest.
+    :param data_source: one of the recognized protein systems in the class
+    :param names: a list of torsion filenames
+    :param thresholds: a list of flux thresholds
+    :param quantity: 'Directional flux', 'Driven flux' or 'Intersurface flux'
+    :param log_min: log10 of the lowest concentration (M)
+    :param log_max: log10 of the highest concentration (M)
+    :param coarse_points: the number of points of the coarse grid
+    :param xtol: the width (in decades) below which bisection stops
+    :param catalytic_rate: override the default catalytic rate of the data source
+    :param parameters: a dictionary of other `Simulation` attributes to override
+    :return: a dataframe with columns 'File', 'Threshold', 'Concentration' (log10) and 'Direction'
+    (+1 where the torsion rises above the threshold, -1 where it falls below). Torsions that are
+    already above a threshold at `log_min` get a +1 row at `log_min`.
+    """
+    import pandas as pd
+    this = Simulation(data_source=data_source)
+    configure(this, dict(parameters or {}, catalytic_rate=catalytic_rate))
+    model = this.parameters()
+    unbound, bound = read_histograms(data_source, names)
+    unbound = histograms_to_energies(unbound, this.kT, this.periodic_smoothing)
+    bound = histograms_to_energies(bound, this.kT, this.periodic_smoothing) - this.offset_factor
+    thresholds = np.asarray(thresholds, dtype=float)
+
+    def evaluate(rows, log_concentrations):
+        model['cSubstrate'] = 10 ** log_concentrations
+        fluxes = simulate_batch(unbound[rows], bound[rows], model, user_energies=True)
+        return np.abs(flux_observables(fluxes)[quantity])
+
+    grid = np.linspace(log_min, log_max, coarse_points)
+    n = len(names)
+    values = evaluate(np.repeat(np.arange(n), coarse_points),
+                      np.tile(grid, n)).reshape(n, coarse_points)
+    # above[t, i, j] is True if torsion i is above threshold t at grid point j.
+    above = values[None, :, :] > thresholds[:, None, None]
+    t, i, j = np.nonzero(above[:, :, 1:] != above[:, :, :-1])
+    lower, upper = grid[j], grid[j + 1]
+    rising = above[t, i, j + 1]
+    while len(t) and np.max(upper - lower) > xtol:
+        middle = (lower + upper) / 2.
+        after = evaluate(i, middle) > thresholds[t]
+        upper = np.where(after == rising, middle, upper)
+        lower = np.where(after == rising, lower, middle)
+    t0, i0 = np.nonzero(above[:, :, 0])
+    return pd.DataFrame({'File': np.asarray(names)[np.concatenate((i0, i))],
+                         'Threshold': thresholds[np.concatenate((t0, t))],
+                         'Concentration': np.concatenate((np.full(len(t0), float(log_min)),
+                                                          (lower + upper) / 2.)),
+                         'Direction': np.concatenate((np.ones(len(t0), dtype=int),
+                                                      np.where(rising, 1, -1)))})
+
+
+def number_above_threshold(crossings, threshold, concentrations):
+    """
+    Count the torsions above a threshold at each concentration, from the output of
+    `find_threshold_crossings`. The counts are exact at every concentration, not only on the
+    grid that was solved.
+    :param crossings: a dataframe returned by `find_threshold_crossings`
+    :param threshold: one of the thresholds that was searched
+    :param concentrations: a list of concentrations (M)
+    :return: the concentrations and the number above threshold, like `find_above_threshold`
+    """
+    tmp = crossings[np.isclose(crossings['Threshold'], threshold)].sort_values('Concentration')
+    steps = np.concatenate(([0], np.cumsum(tmp['Direction'].values)))
+    index = np.searchsorted(tmp['Concentration'].values, np.log10(concentrations), side='right')
+    return list(concentrations), list(steps[index])